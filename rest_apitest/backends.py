@@ -0,0 +1,35 @@
+# coding=utf-8
+"""
+Authentication backends for test runs
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+
+# (username, raw password, encoded password) of every successful check
+_verified = set()
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend that verifies each (username, password) against the stored
+    hash once per test run. Later logins still load the user, but skip the
+    password hasher while the stored hash is unchanged.
+    Only meant for tests, SchemaTestCase installs it when CACHE_AUTHENTICATION is set.
+    """
+    def authenticate(self, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            return None
+        key = (username, password, user.password)
+        if key not in _verified:
+            if not user.check_password(password):
+                return None
+            _verified.add((username, password, user.password))
+        if getattr(self, 'user_can_authenticate', None) and not self.user_can_authenticate(user):
+            return None
+        return user
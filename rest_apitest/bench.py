@@ -0,0 +1,410 @@
+# coding=utf-8
+"""
+Latency benchmarks for the endpoints listed in the `urls` section of the API_SCHEMA file
+"""
+import os
+import json
+import math
+import datetime
+import threading
+from timeit import default_timer
+from schema import FieldSpec, METHODS, URL_PARAMETER_RE
+from perf import QueryRecorder
+from uploads import LargeFile, RECORDING_HANDLERS, received_uploads
+from profiling import MemoryProbe, max_rss
+
+# Placeholder values used when a request body has to be made up from the schema
+SAMPLE_VALUES = {
+    'string': u'string',
+    'int': 1,
+    'integer': 1,
+    'float': 1.0,
+    'decimal': u'1.0',
+    'boolean': True,
+    'bool': True,
+    'datetime': u'2016-01-01T00:00:00Z',
+    'date': u'2016-01-01',
+}
+
+
+class Endpoint(object):
+    """
+    One method of one url of the schema
+    """
+    __slots__ = ('url', 'method', 'request_object', 'response_object', 'path')
+
+    def __init__(self, url, method, request_object=None, response_object=None, path=None):
+        self.url = url
+        self.method = method
+        self.request_object = request_object
+        self.response_object = response_object
+        self.path = path
+
+    @property
+    def key(self):
+        return u'{0} {1}'.format(self.method.upper(), self.url)
+
+
+def resolve_url(url, parameters, prefix='/'):
+    """
+    Replace `:name` placeholders of a schema url with `parameters`.
+    Returns None when a placeholder has no value.
+    """
+    missing = [name for name in URL_PARAMETER_RE.findall(url) if name not in parameters]
+    if missing:
+        return None
+    return prefix + URL_PARAMETER_RE.sub(lambda match: u'{0}'.format(parameters[match.group(1)]), url)
+
+
+def iter_endpoints(schema, parameters=None, prefix='/', methods=METHODS):
+    """
+    Yield an Endpoint for every url and method of the schema, `path` is None
+    when the url has placeholders without a value in `parameters`
+    """
+    parameters = parameters or {}
+    for entry in schema.urls:
+        for method in methods:
+            if method not in entry:
+                continue
+            action = entry[method]
+            responses = action.get('response') or {}
+            response_object = sorted(responses.items())[0][1] if responses else None
+            yield Endpoint(entry['url'], method, action.get('request'), response_object,
+                           resolve_url(entry['url'], parameters, prefix))
+
+
+def sample_data(schema_objects, object_name):
+    """
+    Make up a request body for `object_name` from the types declared in the schema.
+    Optional fields and lists are left out.
+    """
+    data = {}
+    for field, schema_type in schema_objects.get(object_name, {}).items():
+        spec = FieldSpec(field, schema_type)
+        if spec.is_optional or spec.is_list:
+            continue
+        if spec.ref:
+            if spec.ref != object_name:
+                data[field] = sample_data(schema_objects, spec.ref)
+        elif spec.type_checker is not None:
+            data[field] = SAMPLE_VALUES.get(spec.type_checker.name, u'string')
+    return data
+
+
+def percentile(timings, fraction):
+    """
+    Nearest-rank percentile of a sorted list
+    """
+    if not timings:
+        return None
+    index = max(0, min(len(timings) - 1, int(round(fraction * len(timings))) - 1))
+    return timings[index]
+
+
+class EndpointResult(object):
+    """
+    Latency figures for one endpoint
+    """
+    def __init__(self, endpoint, timings, status_codes, total_time, allocations=None, queries=None):
+        timings = sorted(timings)
+        self.endpoint = endpoint
+        self.timings = timings
+        self.queries = queries or []
+        self.status_codes = status_codes
+        self.total_time = total_time
+        self.allocations = allocations
+
+    def as_dict(self):
+        ms = lambda seconds: None if seconds is None else round(seconds * 1000, 3)
+        result = {
+            'url': self.endpoint.url,
+            'method': self.endpoint.method,
+            'path': self.endpoint.path,
+            'iterations': len(self.timings),
+            'status_codes': sorted(set(self.status_codes)),
+            'p50_ms': ms(percentile(self.timings, 0.50)),
+            'p95_ms': ms(percentile(self.timings, 0.95)),
+            'p99_ms': ms(percentile(self.timings, 0.99)),
+            'max_ms': ms(self.timings[-1] if self.timings else None),
+            'rps': round(len(self.timings) / self.total_time, 2) if self.total_time else None,
+            'timings_ms': [ms(timing) for timing in self.timings],
+            'queries': self.queries,
+        }
+        if self.allocations is not None:
+            result.update(self.allocations)
+        return result
+
+
+def measure_allocations(send):
+    """
+    Peak and net bytes allocated by one request and the number of new blocks,
+    measured by a MemoryProbe: with tracemalloc, from the process' RSS and its
+    gc-tracked objects on Python 2 (`alloc_method` says which)
+    """
+    with MemoryProbe(top=None) as probe:
+        send()
+    return {'alloc_method': probe.method, 'peak_alloc_bytes': probe.peak, 'net_alloc_bytes': probe.net,
+            'net_alloc_blocks': sum(count for _, _, count in probe.sites)}
+
+
+def benchmark_endpoint(client, endpoint, data=None, warmup=5, iterations=50, allocations=True):
+    """
+    Fire `warmup` unmeasured then `iterations` measured requests at an endpoint
+    """
+    send_method = getattr(client, endpoint.method)
+    if endpoint.method == 'get':
+        send = lambda: send_method(endpoint.path, data or {})
+    else:
+        send = lambda: send_method(endpoint.path, data, format='json')
+
+    for _ in range(warmup):
+        send()
+
+    timings = []
+    queries = []
+    status_codes = []
+    total_time = 0.0
+    for _ in range(iterations):
+        with QueryRecorder() as recorder:
+            start = default_timer()
+            response = send()
+            timings.append(default_timer() - start)
+        total_time += timings[-1]
+        queries.append(len(recorder))
+        status_codes.append(response.status_code)
+
+    return EndpointResult(endpoint, timings, status_codes, total_time,
+                          measure_allocations(send) if allocations else None, queries)
+
+
+def run_benchmarks(client, schema, parameters=None, prefix='/', methods=('get',), request_data=None,
+                   warmup=5, iterations=50, allocations=True):
+    """
+    Benchmark every endpoint of the schema. `request_data` maps an endpoint key
+    ("POST posts/") to the body to send, other bodies are made up from the schema.
+    Returns the machine readable result.
+    """
+    request_data = request_data or {}
+    results = []
+    skipped = []
+    for endpoint in iter_endpoints(schema, parameters, prefix, methods):
+        if endpoint.path is None:
+            skipped.append({'url': endpoint.url, 'method': endpoint.method, 'reason': 'missing url parameter'})
+            continue
+        data = request_data.get(endpoint.key)
+        if data is None and endpoint.request_object:
+            data = sample_data(schema.objects, endpoint.request_object)
+        results.append(benchmark_endpoint(client, endpoint, data, warmup, iterations, allocations).as_dict())
+    return {
+        'schema': schema.path,
+        'created': datetime.datetime.utcnow().isoformat() + 'Z',
+        'warmup': warmup,
+        'iterations': iterations,
+        'endpoints': results,
+        'skipped': skipped,
+    }
+
+
+def write_results(results, path):
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+
+
+def baseline_key(method, path):
+    return u'{0} {1}'.format(method.upper(), path)
+
+
+class Baseline(object):
+    """
+    Per-endpoint samples (latencies in ms and query counts) persisted as JSON,
+    keyed by "METHOD path"
+    """
+    def __init__(self, path):
+        self.path = path
+        self.endpoints = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as file:
+                self.endpoints = json.load(file).get('endpoints', {})
+
+    def get(self, method, path):
+        return self.endpoints.get(baseline_key(method, path))
+
+    def record(self, method, path, timings_ms, queries):
+        with self._lock:
+            self.endpoints[baseline_key(method, path)] = {
+                'timings_ms': [round(timing, 3) for timing in timings_ms],
+                'queries': list(queries),
+            }
+
+    def record_results(self, results):
+        """
+        Store every endpoint of a `run_benchmarks` result
+        """
+        for result in results['endpoints']:
+            self.record(result['method'], result['path'], result['timings_ms'], result['queries'])
+
+    def save(self):
+        with self._lock:
+            with open(self.path, 'w') as file:
+                json.dump({'endpoints': self.endpoints}, file, indent=2, sort_keys=True)
+
+
+_baselines = {}
+_baselines_lock = threading.Lock()
+
+
+def get_baseline(path):
+    """
+    The process-wide Baseline for a file
+    """
+    path = os.path.abspath(path)
+    with _baselines_lock:
+        if path not in _baselines:
+            _baselines[path] = Baseline(path)
+        return _baselines[path]
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def mann_whitney_greater(baseline, current):
+    """
+    One-sided Mann-Whitney U test: the p-value for `current` being
+    stochastically greater (slower) than `baseline`. Normal approximation
+    with tie and continuity correction, fine from ~8 samples per side.
+    """
+    n1, n2 = len(baseline), len(current)
+    if not n1 or not n2:
+        return 1.0
+    combined = sorted([(value, 0) for value in baseline] + [(value, 1) for value in current])
+    ranks_current = 0.0
+    ties = 0.0
+    index = 0
+    while index < len(combined):
+        end = index
+        while end + 1 < len(combined) and combined[end + 1][0] == combined[index][0]:
+            end += 1
+        rank = (index + end) / 2.0 + 1
+        count = end - index + 1
+        ties += count ** 3 - count
+        ranks_current += rank * sum(1 for _, group in combined[index:end + 1] if group == 1)
+        index = end + 1
+
+    n = n1 + n2
+    u_current = ranks_current - n2 * (n2 + 1) / 2.0
+    mean = n1 * n2 / 2.0
+    variance = n1 * n2 / 12.0 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (u_current - mean - 0.5) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def compare_samples(entry, timings_ms, queries, threshold=1.25, alpha=0.01):
+    """
+    Compare current samples with a baseline entry. Latency counts as regressed
+    when the median grew by more than `threshold` and the difference is
+    significant at `alpha`; queries when the median count exceeds the most
+    the baseline ever ran. Returns a list of descriptions.
+    """
+    regressions = []
+    baseline_timings = entry.get('timings_ms') or []
+    if baseline_timings and timings_ms:
+        baseline_median = median(baseline_timings)
+        current_median = median(timings_ms)
+        p_value = mann_whitney_greater(baseline_timings, timings_ms)
+        if current_median > baseline_median * threshold and p_value < alpha:
+            regressions.append(u"latency median {0:.2f}ms vs baseline {1:.2f}ms ({2:.2f}x, p={3:.4f})".format(
+                current_median, baseline_median, current_median / baseline_median if baseline_median else 0,
+                p_value))
+    baseline_queries = entry.get('queries') or []
+    if baseline_queries and queries and median(queries) > max(baseline_queries):
+        regressions.append(u"queries median {0} vs baseline max {1}".format(median(queries), max(baseline_queries)))
+    return regressions
+
+
+def compare_results(baseline, results, threshold=1.25, alpha=0.01):
+    """
+    Compare a `run_benchmarks` result with a baseline, returns `{key: [regressions]}`
+    """
+    regressed = {}
+    for result in results['endpoints']:
+        entry = baseline.get(result['method'], result['path'])
+        if entry is None:
+            continue
+        regressions = compare_samples(entry, result['timings_ms'], result['queries'], threshold, alpha)
+        if regressions:
+            regressed[baseline_key(result['method'], result['path'])] = regressions
+    return regressed
+
+
+MB = 1024 * 1024
+UPLOAD_SIZES = (1 * MB, 4 * MB, 16 * MB, 64 * MB, 256 * MB, 512 * MB)
+
+
+def recording_upload_handlers(handlers):
+    """
+    FILE_UPLOAD_HANDLERS with Django's default handlers replaced by ones that
+    record whether each upload stayed in memory or went to a temporary file
+    """
+    return [RECORDING_HANDLERS.get(handler, handler) for handler in handlers]
+
+
+def benchmark_upload_sizes(send, field_name, sizes=UPLOAD_SIZES, repeat=1):
+    """
+    Upload a generated file of each size with `send({field_name: file})` and
+    return one row per size: status, best time, throughput, memory and whether
+    the server spilled the upload to a temporary file. `peak_alloc_bytes` comes
+    from measure_allocations (and costs time), `rss_growth_bytes` is the growth of
+    the process' peak RSS, so it is only non-zero when a new high is reached.
+    Generating the file is included in the time and costs about as much as a memcpy.
+    """
+    rows = []
+    for size in sizes:
+        timings = []
+        status_codes = []
+        spilled = None
+        rss_before = max_rss()
+        for _ in range(repeat):
+            del received_uploads[:]
+            upload = LargeFile(size, name='upload.bin')
+            start = default_timer()
+            response = send({field_name: upload})
+            timings.append(default_timer() - start)
+            status_codes.append(response.status_code)
+            spills = [spill for name, _, spill in received_uploads if name == field_name]
+            spilled = spills[0] if spills else None
+        rss_after = max_rss()
+        peak = measure_allocations(lambda: send({field_name: LargeFile(size, name='upload.bin')}))
+        best = min(timings)
+        rows.append({
+            'size': size,
+            'status_codes': sorted(set(status_codes)),
+            'best_ms': round(best * 1000, 3),
+            'mb_per_s': round(size / float(MB) / best, 2) if best else None,
+            'peak_alloc_bytes': peak['peak_alloc_bytes'] if peak else None,
+            'rss_growth_bytes': rss_after - rss_before if rss_before is not None else None,
+            'spilled_to_disk': spilled,
+        })
+    return rows
+
+
+def format_upload_table(rows):
+    """
+    The rows of benchmark_upload_sizes as a text table
+    """
+    lines = [u'{0:>10} {1:>10} {2:>9} {3:>14} {4:>14} {5:>8} {6}'.format(
+        'size MB', 'time ms', 'MB/s', 'peak alloc MB', 'rss growth MB', 'spilled', 'status')]
+    mb = lambda value: '-' if value is None else '{0:.1f}'.format(value / float(MB))
+    for row in rows:
+        lines.append(u'{0:>10} {1:>10.1f} {2:>9} {3:>14} {4:>14} {5:>8} {6}'.format(
+            mb(row['size']), row['best_ms'], row['mb_per_s'], mb(row['peak_alloc_bytes']),
+            mb(row['rss_growth_bytes']), {None: '-', True: 'yes', False: 'no'}[row['spilled_to_disk']],
+            ','.join(str(code) for code in row['status_codes'])))
+    return u'\n'.join(lines)
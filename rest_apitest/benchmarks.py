@@ -0,0 +1,103 @@
+# coding=utf-8
+"""
+Micro-benchmarks for the schema validator, exits with status 1 when CHECK_TYPES
+costs more than TYPE_CHECK_BUDGET
+
+    python -m rest_apitest.benchmarks
+"""
+import gc
+import sys
+from timeit import default_timer
+from schema import compile_objects, validate_data
+
+# Ceiling for the relative cost of CHECK_TYPES on top of key-only validation.
+# Checking types costs about twice the key checks on these objects (the type of
+# every scalar field, a regex per datetime, the elements of `tags`), a 10% budget
+# is out of reach for a pure Python validator. This only catches regressions.
+TYPE_CHECK_BUDGET = 3.0
+
+BENCHMARK_OBJECTS = {
+    "$postResponse": {
+        "id": "int,primarykey",
+        "title": "string,optional",
+        "description": "string,optional",
+        "content_type": "int",
+        "created": "datetime",
+        "is_public": "boolean",
+        "score": "float",
+        "tags": "array,int",
+        "user": "$userResponse"
+    },
+    "$userResponse": {
+        "id": "int,primarykey",
+        "username": "string",
+        "email": "string,optional",
+        "about": "string",
+        "date_joined": "datetime",
+        "user_following_count": "int",
+        "user_followers_count": "int",
+        "thumbnail": "image,optional"
+    }
+}
+
+
+def benchmark_rows(count):
+    return [{
+        "id": index,
+        "title": u"post {0}".format(index),
+        "description": None,
+        "content_type": 12,
+        "created": u"2016-10-18T12:{0:02d}:{1:02d}.123456Z".format(index // 60 % 60, index % 60),
+        "is_public": index % 2 == 0,
+        "score": index * 1.5,
+        "tags": [1, 2, 3],
+        "user": {
+            "id": index,
+            "username": u"person{0}".format(index),
+            "email": u"person{0}@example.com".format(index),
+            "about": u"",
+            "date_joined": u"2016-{0:02d}-18T12:00:00Z".format(index % 12 + 1),
+            "user_following_count": 3,
+            "user_followers_count": 5,
+            "thumbnail": None
+        }
+    } for index in range(count)]
+
+
+def best_of(repeat, *funcs):
+    """
+    Best time of each function over `repeat` rounds. The functions take turns
+    and the collector is off, like timeit, so a busy moment hits all of them.
+    """
+    timings = [[] for _ in funcs]
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            for func, times in zip(funcs, timings):
+                start = default_timer()
+                func()
+                times.append(default_timer() - start)
+    finally:
+        if enabled:
+            gc.enable()
+    return [min(times) for times in timings]
+
+
+def type_check_overhead(rows=5000, repeat=9):
+    """
+    Validate `rows` list elements with and without type checks and return
+    (key-only seconds, typed seconds, relative overhead)
+    """
+    validator = compile_objects(BENCHMARK_OBJECTS)["$postResponse"]
+    data = benchmark_rows(rows)
+    keys_only, typed = best_of(repeat, lambda: validate_data(validator, data, "all", many=True),
+                               lambda: validate_data(validator, data, "all", many=True, check_types=True))
+    return keys_only, typed, typed / keys_only - 1
+
+
+if __name__ == "__main__":
+    keys_only, typed, overhead = type_check_overhead()
+    print("keys only: {0:.2f}ms  with types: {1:.2f}ms  overhead: {2:.1%} (budget {3:.0%})".format(
+        keys_only * 1000, typed * 1000, overhead, TYPE_CHECK_BUDGET))
+    sys.exit(overhead > TYPE_CHECK_BUDGET)
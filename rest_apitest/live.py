@@ -0,0 +1,355 @@
+# coding=utf-8
+"""
+Load tests against a live server, replaying the requests described by API_SCHEMA
+"""
+import json
+import random
+import socket
+import threading
+from timeit import default_timer
+from django.conf import settings
+from django.db import connections
+from django.core.servers.basehttp import WSGIServer
+from django.test import LiveServerTestCase
+from django.test.testcases import LiveServerThread, QuietWSGIRequestHandler
+from django.utils.six.moves import socketserver
+from django.utils.six.moves.urllib.parse import urlencode
+from django.utils.six.moves.http_client import HTTPConnection
+from schema import SchemaError, registry, VALIDATE_FIRST
+from stream import validate_stream
+from bench import iter_endpoints, sample_data, percentile
+
+
+class ThreadedWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class ThreadedLiveServerThread(LiveServerThread):
+    """
+    Serves every connection in its own thread, so concurrent clients contend
+    for the application instead of queueing in front of a single server thread
+    """
+    def _create_server(self, port):
+        return ThreadedWSGIServer((self.host, port), QuietWSGIRequestHandler)
+
+
+# The statuses SchemaTestCase's assertSchema* methods accept
+SUCCESS_STATUS = {'get': (200,), 'post': (200, 201), 'put': (200,), 'patch': (200,), 'delete': (202, 204)}
+NOT_ALLOWED_STATUS = (401, 403, 404, 405)
+
+
+class LoadRequest(object):
+    """
+    One request to replay, `response_object` is the schema object the response
+    is validated against. `headers` are sent on top of the run's headers, e.g.
+    another user's Authorization, and `unauthorized` expects the request to be refused.
+    """
+    __slots__ = ('method', 'path', 'data', 'response_object', 'headers', 'unauthorized')
+
+    def __init__(self, method, path, data=None, response_object=None, headers=None, unauthorized=False):
+        self.method = method
+        self.path = path
+        self.data = data
+        self.response_object = response_object
+        self.headers = headers
+        self.unauthorized = unauthorized
+
+    @property
+    def key(self):
+        return u'{0} {1}'.format(self.method.upper(), self.path)
+
+
+class LoadReport(object):
+    """
+    Throughput, latency percentiles and errors of a load run
+    """
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.duration = 0.0
+        # endpoint key -> list of seconds
+        self.timings = {}
+        self.status_codes = {}
+        self.errors = []
+        self.validated = 0
+        self.validation_errors = []
+        self._lock = threading.Lock()
+
+    def add(self, request, elapsed, status_code):
+        with self._lock:
+            self.timings.setdefault(request.key, []).append(elapsed)
+            self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+
+    def add_error(self, request, message):
+        with self._lock:
+            self.errors.append(u'{0}: {1}'.format(request.key, message))
+
+    def add_validation(self, request, error=None):
+        with self._lock:
+            self.validated += 1
+            if error is not None:
+                self.validation_errors.append(u'{0}: {1}'.format(request.key, error))
+
+    @property
+    def requests(self):
+        return sum(len(timings) for timings in self.timings.values())
+
+    @property
+    def rps(self):
+        return self.requests / self.duration if self.duration else 0.0
+
+    @property
+    def error_rate(self):
+        failed = len(self.errors) + sum(count for status, count in self.status_codes.items() if status >= 400)
+        total = self.requests + len(self.errors)
+        return float(failed) / total if total else 0.0
+
+    def latency_ms(self, fraction, key=None):
+        timings = sorted(self.timings.get(key, []) if key else
+                         [timing for timings in self.timings.values() for timing in timings])
+        value = percentile(timings, fraction)
+        return None if value is None else value * 1000
+
+    def as_dict(self):
+        endpoints = {}
+        for key in self.timings:
+            endpoints[key] = {
+                'requests': len(self.timings[key]),
+                'p50_ms': self.latency_ms(0.50, key),
+                'p95_ms': self.latency_ms(0.95, key),
+                'p99_ms': self.latency_ms(0.99, key),
+            }
+        return {
+            'concurrency': self.concurrency,
+            'duration': self.duration,
+            'requests': self.requests,
+            'rps': self.rps,
+            'p50_ms': self.latency_ms(0.50),
+            'p95_ms': self.latency_ms(0.95),
+            'p99_ms': self.latency_ms(0.99),
+            'max_ms': self.latency_ms(1.0),
+            'status_codes': self.status_codes,
+            'errors': self.errors,
+            'error_rate': self.error_rate,
+            'validated': self.validated,
+            'validation_errors': self.validation_errors,
+            'endpoints': endpoints,
+        }
+
+    def __repr__(self):
+        return '<LoadReport {0} requests {1:.1f} rps p50={2:.1f}ms p99={3:.1f}ms errors={4}>'.format(
+            self.requests, self.rps, self.latency_ms(0.50) or 0, self.latency_ms(0.99) or 0,
+            len(self.errors) + len(self.validation_errors))
+
+
+class SchemaLoadTest(LiveServerTestCase):
+    """
+    Replays schema described requests against a live server from a pool of
+    threads, each keeping its HTTP connection open for as long as the server
+    allows, and reports throughput and tail latency under contention.
+    A sample of the responses is validated like SchemaTestCase does.
+    `assertSchemaGather` fires a batch of different requests at once, e.g. a
+    permission matrix across users, and validates every response.
+
+    The server handles each connection in its own thread, except on an
+    in-memory SQLite database which the server threads would share.
+    """
+    # Number of client threads
+    CONCURRENCY = 8
+    # Seconds each run lasts, unless MAX_REQUESTS is reached first
+    DURATION = 5.0
+    MAX_REQUESTS = None
+    # Share of the responses validated against the schema
+    VALIDATE_SAMPLE = 0.1
+    VALIDATE_MODE = VALIDATE_FIRST
+    CHECK_TYPES = False
+    # Seconds before a request is abandoned
+    TIMEOUT = 30
+
+    @classmethod
+    def _create_server_thread(cls, host, possible_ports, connections_override):
+        in_memory = any(connection.vendor == 'sqlite' and connection.is_in_memory_db(connection.settings_dict['NAME'])
+                        for connection in connections.all())
+        thread_class = LiveServerThread if in_memory else ThreadedLiveServerThread
+        return thread_class(host, possible_ports, cls.static_handler, connections_override=connections_override)
+
+    def setUp(self):
+        super(SchemaLoadTest, self).setUp()
+        user_settings = getattr(settings, 'API_SCHEMA', None)
+        assert user_settings is not None, u"please set an variable what's name is API_SCHEMA in your project's " \
+                                          u"and it's value must be a absolute file path"
+        self.schema = registry.get(user_settings)
+
+    def schema_requests(self, parameters=None, methods=('get',), prefix='/'):
+        """
+        A LoadRequest for every url of the schema whose placeholders have a value
+        in `parameters`, bodies are made up from the request objects
+        """
+        requests = []
+        for endpoint in iter_endpoints(self.schema, parameters, prefix, methods):
+            if endpoint.path is None:
+                continue
+            data = sample_data(self.schema.objects, endpoint.request_object) if endpoint.request_object else None
+            requests.append(LoadRequest(endpoint.method, endpoint.path, data, endpoint.response_object))
+        return requests
+
+    def send(self, connection, request, headers):
+        """
+        Send one request on a kept-alive connection, returns (status, body)
+        """
+        path = request.path
+        body = None
+        headers = dict(headers)
+        headers.update(request.headers or {})
+        if request.method == 'get':
+            if request.data:
+                path += '?' + urlencode(request.data)
+        elif request.data is not None:
+            body = json.dumps(request.data)
+            headers['Content-Type'] = 'application/json'
+        connection.request(request.method.upper(), path, body, headers)
+        response = connection.getresponse()
+        return response.status, response.read()
+
+    def validate(self, request, body):
+        """
+        Check a response body against its schema object, returns the error or None
+        """
+        try:
+            validate_stream(self.schema.validators[request.response_object], [body],
+                            self.VALIDATE_MODE, check_types=self.CHECK_TYPES)
+        except SchemaError as error:
+            return error
+        return None
+
+    def run_load(self, requests, headers=None, concurrency=None, duration=None, max_requests=None):
+        """
+        Replay `requests` (round robin, from a random offset per thread) and
+        return a LoadReport. `headers` are sent with every request, e.g.
+        {'Authorization': basic_auth_str(username, password)}.
+        """
+        concurrency = concurrency or self.CONCURRENCY
+        duration = duration or self.DURATION
+        max_requests = max_requests or self.MAX_REQUESTS
+        headers = headers or {}
+        report = LoadReport(concurrency)
+        issued = [0]
+        issued_lock = threading.Lock()
+        host, port = self.server_thread.host, self.server_thread.port
+
+        def take_turn():
+            with issued_lock:
+                if max_requests is not None and issued[0] >= max_requests:
+                    return False
+                issued[0] += 1
+                return True
+
+        def worker(seed):
+            sampler = random.Random(seed)
+            connection = HTTPConnection(host, port, timeout=self.TIMEOUT)
+            index = sampler.randrange(len(requests))
+            try:
+                while default_timer() < deadline and take_turn():
+                    request = requests[index % len(requests)]
+                    index += 1
+                    start = default_timer()
+                    try:
+                        status, body = self.send(connection, request, headers)
+                    except (socket.error, IOError) as error:
+                        connection.close()
+                        report.add_error(request, error)
+                        continue
+                    report.add(request, default_timer() - start, status)
+                    if request.response_object and status < 400 and sampler.random() < self.VALIDATE_SAMPLE:
+                        report.add_validation(request, self.validate(request, body))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(concurrency)]
+        start = default_timer()
+        deadline = start + duration
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report.duration = default_timer() - start
+        return report
+
+    def gather(self, requests, headers=None, concurrency=None):
+        """
+        Send every request once, `concurrency` at a time, and return
+        `(status, body)` pairs in the order of `requests`. A request that
+        could not be sent gives `(None, error)`.
+        """
+        requests = list(requests)
+        concurrency = min(concurrency or self.CONCURRENCY, len(requests))
+        headers = headers or {}
+        results = [None] * len(requests)
+        pending = list(range(len(requests) - 1, -1, -1))
+        pending_lock = threading.Lock()
+        host, port = self.server_thread.host, self.server_thread.port
+
+        def worker():
+            connection = HTTPConnection(host, port, timeout=self.TIMEOUT)
+            try:
+                while True:
+                    with pending_lock:
+                        if not pending:
+                            return
+                        index = pending.pop()
+                    try:
+                        results[index] = self.send(connection, requests[index], headers)
+                    except (socket.error, IOError) as error:
+                        connection.close()
+                        results[index] = (None, error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def assertSchemaGather(self, requests, headers=None, concurrency=None):
+        """
+        Send the requests concurrently like `gather` and check each response:
+        the status expected by the matching assertSchema* method (or a refusal
+        for `unauthorized` requests), and the body against `response_object`.
+        Every failure is collected into one report.
+        """
+        requests = list(requests)
+        results = self.gather(requests, headers, concurrency)
+        failures = []
+        for request, (status, body) in zip(requests, results):
+            if status is None:
+                failures.append(u"{0}: {1}".format(request.key, body))
+                continue
+            expected = NOT_ALLOWED_STATUS if request.unauthorized else SUCCESS_STATUS[request.method]
+            if status not in expected:
+                failures.append(u"{0}: status {1}, expected one of {2}".format(request.key, status, expected))
+            elif request.response_object and not request.unauthorized and status != 204:
+                error = self.validate(request, body)
+                if error is not None:
+                    failures.append(u"{0}: {1}".format(request.key, error))
+        if failures:
+            raise self.failureException(u"{0} of {1} requests failed:\n  {2}".format(
+                len(failures), len(requests), u"\n  ".join(failures)))
+        return results
+
+    def assertLoad(self, report, min_rps=None, max_p99_ms=None, max_error_rate=0.0):
+        """
+        Fails on schema mismatches in the sampled responses and on the given
+        throughput, tail latency and error rate limits
+        """
+        problems = list(report.validation_errors)
+        if report.error_rate > max_error_rate:
+            problems.append(u"error rate {0:.1%} > {1:.1%} {2}".format(
+                report.error_rate, max_error_rate, report.errors[:5] or report.status_codes))
+        if min_rps is not None and report.rps < min_rps:
+            problems.append(u"throughput {0:.1f} rps < min_rps={1}".format(report.rps, min_rps))
+        if max_p99_ms is not None and report.requests and report.latency_ms(0.99) > max_p99_ms:
+            problems.append(u"p99 {0:.1f}ms > max_p99_ms={1}".format(report.latency_ms(0.99), max_p99_ms))
+        if problems:
+            raise self.failureException(u"Load test failed ({0!r}):\n  {1}".format(report, u"\n  ".join(problems)))
+        return report
@@ -1,8 +1,54 @@
 # coding=utf-8
+import os
+import warnings
+from timeit import default_timer
 from util import APITestCaseWithAssertions
 from django.conf import settings
-import json
-from util import basic_auth_str
+from django.utils import six
+from django.test.utils import override_settings
+from util import basic_auth_str, session_exists, token_pool
+from schema import registry, validate_data, VALIDATE_FIRST
+from stream import iter_chunks, validate_stream
+from perf import measure, budget_violations, budget_report, repeated_statements, scaling_statements
+from bench import get_baseline, compare_samples, benchmark_upload_sizes, recording_upload_handlers, UPLOAD_SIZES
+from sharding import record_test, append_partial
+from uploads import MultipartStream, files_equal
+from profiling import MemoryProbe, profile_cpu, record_memory, record_cpu, endpoint_key, time_phases, record_phases
+
+
+class BatchResult(object):
+    """
+    Outcome of assertSchemaBatch: one `(index, case, response or None, error or None)`
+    entry per case, in the order the cases were given
+    """
+    def __init__(self):
+        self.entries = []
+        self.elapsed = 0.0
+
+    def add(self, index, case, response=None, error=None):
+        self.entries.append((index, case, response, error))
+
+    @property
+    def failures(self):
+        return [entry for entry in self.entries if entry[3] is not None]
+
+    @property
+    def request_ms(self):
+        return sum(entry[2].metrics.ms for entry in self.entries
+                   if entry[2] is not None and hasattr(entry[2], 'metrics'))
+
+    def report(self):
+        lines = [u"{0} of {1} cases failed ({2:.1f}ms, {3:.1f}ms in requests):".format(
+            len(self.failures), len(self.entries), self.elapsed * 1000, self.request_ms)]
+        for index, case, _, error in self.failures:
+            user = case.get('user')
+            lines.append(u"  #{0} {1} as {2}: {3}".format(index, case.get('url'), getattr(user, 'username', user),
+                                                        error))
+        return u"\n".join(lines)
+
+
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+CACHED_BACKEND = 'rest_apitest.backends.CachedModelBackend'
 
 
 class SchemaTestCase(APITestCaseWithAssertions):
@@ -11,9 +57,131 @@ class SchemaTestCase(APITestCaseWithAssertions):
 
     AUTH_TYPE = ['basic_credential', 'session_credential', 'oauth_credential']
 
+    # Also check the values of scalar fields against the types declared in the schema
+    CHECK_TYPES = False
+
+    # Validate the rendered bytes (`response.content` / `streaming_content`) with an
+    # incremental parser instead of the Python objects in `response.data`
+    VALIDATE_RENDERED = False
+
+    # What to do when a list response runs the same SQL statement once per row:
+    # None to ignore, "warn" or "fail"
+    N_PLUS_ONE = 'warn'
+
+    # Compare GET requests with the benchmark baseline file in settings.API_BENCHMARK_BASELINE:
+    # None to skip, "record" to (re)write the baseline, "warn" or "fail" on a regression.
+    # The REST_APITEST_BASELINE_MODE environment variable overrides it. New samples go to
+    # `<baseline>.partial`, SchemaTestRunner writes them into the baseline after the run.
+    BASELINE_MODE = None
+    BASELINE_SAMPLES = 15
+    # A latency regression is a median this many times slower than the baseline...
+    BASELINE_THRESHOLD = 1.25
+    # ...that is also significant at this level (one-sided Mann-Whitney U test)
+    BASELINE_ALPHA = 0.01
+
+    # Take tracemalloc snapshots around each request (RSS and gc object counts on Python 2):
+    # peak and net bytes and the top allocation sites are stored on the response as `memory` and, with
+    # settings.API_MEMORY_REPORT set, ranked per endpoint over the run by SchemaTestRunner.
+    # The REST_APITEST_PROFILE_MEMORY environment variable overrides it.
+    PROFILE_MEMORY = False
+
+    # Run cProfile and a stack sampler around each request: the pstats.Stats and collapsed
+    # stacks are stored on the response as `cpu_profile` and, with settings.API_PROFILE_DIR
+    # set, merged per endpoint over the run into <endpoint>.prof / .folded files.
+    # The REST_APITEST_PROFILE_CPU environment variable overrides it.
+    PROFILE_CPU = False
+
+    # Time the phases of each request (authentication, permission and throttle checks,
+    # view, serializer .data, rendering): the seconds are stored on the response as
+    # `phases` and, with settings.API_PHASE_REPORT set, averaged over the run per auth_type
+    # and per endpoint. The REST_APITEST_PROFILE_PHASES environment variable overrides it.
+    PROFILE_PHASES = False
+
+    # Objects built once per class in setUpTestData and shared by all of its tests,
+    # which run inside a transaction rolled back after each one. Treat them as read-only.
+    # A tuple of (attribute name, factory or other callable[, keyword arguments]) e.g.
+    # (('user', UserBasicFactory), ('admin', AdminFactory, {'username': 'admin'}))
+    FIXTURES_FROM_FACTORIES = ()
+
+    # Names of fixtures to log in once per class for session_credential. A session
+    # made in setUpTestData outlives each test's rollback, one made by session_credential
+    # during a test is rolled back with it and only reused within that test.
+    LOGIN_FIXTURES = ()
+
+    # Verify each user's password once per test run instead of on every request
+    # (rest_apitest.backends.CachedModelBackend replaces ModelBackend)
+    CACHE_AUTHENTICATION = False
+
+    # Password hasher used while the class runs, so factory users (each with their own
+    # password) are cheap to create and log in. None keeps the project's PASSWORD_HASHERS.
+    FAST_PASSWORD_HASHER = 'django.contrib.auth.hashers.MD5PasswordHasher'
+
+    # (test class, user pk, password hash) -> session and CSRF cookie values of a login
+    _session_cookies = {}
+
+    @classmethod
+    def setUpClass(cls):
+        cls._hasher_override = None
+        if cls.FAST_PASSWORD_HASHER is not None:
+            # The project's hashers stay listed so hashes made with them still verify
+            hashers = [cls.FAST_PASSWORD_HASHER] + [hasher for hasher in settings.PASSWORD_HASHERS
+                                                    if hasher != cls.FAST_PASSWORD_HASHER]
+            cls._hasher_override = override_settings(PASSWORD_HASHERS=hashers)
+            cls._hasher_override.enable()
+        try:
+            super(SchemaTestCase, cls).setUpClass()
+        except Exception:
+            cls.disable_hasher_override()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            super(SchemaTestCase, cls).tearDownClass()
+        finally:
+            cls.disable_hasher_override()
+
+    @classmethod
+    def disable_hasher_override(cls):
+        if cls._hasher_override is not None:
+            cls._hasher_override.disable()
+            cls._hasher_override = None
+
+    @classmethod
+    def setUpTestData(cls):
+        super(SchemaTestCase, cls).setUpTestData()
+        for fixture in cls.FIXTURES_FROM_FACTORIES:
+            name, factory = fixture[:2]
+            kwargs = fixture[2] if len(fixture) > 2 else {}
+            setattr(cls, name, factory(**kwargs))
+        for name in cls.LOGIN_FIXTURES:
+            user = getattr(cls, name)
+            client = cls.client_class()
+            client.login(username=user.username, password=user.cached_raw_password)
+            cls.remember_session(user, client)
+
+    @classmethod
+    def remember_session(cls, user, client):
+        # Keyed by the password hash too, so a password change logs in again
+        cls._session_cookies[(cls, user.pk, user.password)] = dict(
+            (name, client.cookies[name].value) for name in (settings.SESSION_COOKIE_NAME, settings.CSRF_COOKIE_NAME)
+            if name in client.cookies)
+
+    def run(self, result=None):
+        """
+        Record the wall time of the test in settings.API_TEST_TIMINGS, see SchemaTestRunner
+        """
+        self._requests = []
+        timings_path = getattr(settings, 'API_TEST_TIMINGS', None)
+        start = default_timer()
+        try:
+            return super(SchemaTestCase, self).run(result)
+        finally:
+            if timings_path is not None:
+                record_test(timings_path, self.id(), default_timer() - start, self._requests)
+
     def setUp(self, **kwargs):
         super(SchemaTestCase, self).setUp()
-        self.schema_objects = {}
 
         user_settings = getattr(settings, 'API_SCHEMA', None)
         assert user_settings is not None, u"please set an variable what's name is API_SCHEMA in your project's " \
@@ -25,65 +193,32 @@ class SchemaTestCase(APITestCaseWithAssertions):
             handler = getattr(self, self.auth_type)
             setattr(self, 'add_credentials', handler)
 
-        with open(user_settings) as file:
-            schema_data = json.loads(file.read())
-            self.schema_objects = schema_data['objects']
+        # Tokens minted during the test are rolled back with it
+        token_pool.begin()
+        self.addCleanup(token_pool.end)
+
+        if self.CACHE_AUTHENTICATION:
+            backends = [CACHED_BACKEND if backend == MODEL_BACKEND else backend
+                        for backend in settings.AUTHENTICATION_BACKENDS]
+            if CACHED_BACKEND not in backends:
+                backends.insert(0, CACHED_BACKEND)
+            override = override_settings(AUTHENTICATION_BACKENDS=backends)
+            override.enable()
+            self.addCleanup(override.disable)
 
-    def check_schema_keys(self, data_object, schema_fields):
+        # The schema file is parsed once per process and shared by every test case
+        self.schema = registry.get(user_settings)
+        self.schema_objects = self.schema.objects
+
+    def check_schema_keys(self, data_object, schema_fields, validate_mode=VALIDATE_FIRST):
         """
         `data_object` is the actual JSON being sent or received
         `schema_fields` is the expected JSON based on the schema file
+        `validate_mode` is one of "first", "all" or "sample:N" and decides how
+        many elements of nested lists are checked
         """
-        required_fields = []
-
-        for schema_field, schema_type in schema_fields.items():
-            # If this field is actually another related object, then check that object's fields as well
-            schema_parts = schema_type.split(',')
-            is_list = False
-            is_optional = False
-            new_schema_object = None
-            for part in schema_parts:
-                # Parse through all parts, regardless of ordering
-                if part in ["array", "O2M", "M2M"]:
-                    is_list = True
-                elif part == "optional":
-                    is_optional = True
-                elif part.startswith('$'):
-                    new_schema_object = part
-
-            if not is_optional:
-                required_fields.append(schema_field)
-
-            if new_schema_object:
-                if schema_field not in data_object or data_object[schema_field] is None:
-                    # If our new object to check is None and optional then continue, else raise an error
-                    if is_optional:
-                        continue
-                    else:
-                        raise self.failureException("No data for object {0}".format(new_schema_object))
-
-                new_data_object = data_object[schema_field]
-                if is_list:
-                    # If our new object to check is a list of these objects, continue if we don't have any data
-                    # Else grab the first one in the list
-                    if len(new_data_object) == 0:
-                        continue
-                    new_data_object = new_data_object[0]
-
-                self.check_schema_keys(new_data_object, self.schema_objects[new_schema_object])
-
-        set_required_fields = set(required_fields)
-        set_data_object = set(data_object)
-        set_schema_fields = set(schema_fields)
-        # The actual `data_object` contains every required field
-        self.assertTrue(set_required_fields.issubset(set_data_object),
-                        "Data did not match schema.\nMissing fields: {}".format(
-                            set_required_fields.difference(set_data_object)))
-
-        # The actual `data_object` contains no extraneous fields not found in the schema
-        self.assertTrue(set_data_object.issubset(set_schema_fields),
-                        "Data did not match schema.\nExtra fields: {}".format(
-                            set_data_object.difference(set_schema_fields)))
+        return validate_data(self.schema.validator_for(schema_fields), data_object, validate_mode,
+                             check_types=self.CHECK_TYPES)
 
     def session_credential(self, user):
         """
@@ -91,11 +226,34 @@ class SchemaTestCase(APITestCaseWithAssertions):
         The login method functions exactly as it does with Django's regular Client class.
         This allows you to authenticate requests against any views which include SessionAuthentication.
         """
+        if not user:
+            self.session_logout()
+            return
+        # Reuse the cookies of an earlier login while its session is still stored:
+        # one made in setUpTestData (LOGIN_FIXTURES) or earlier in this test
+        cookies = self._session_cookies.get((type(self), user.pk, user.password))
+        if cookies is not None and session_exists(cookies.get(settings.SESSION_COOKIE_NAME)):
+            for name, value in cookies.items():
+                self.client.cookies[name] = value
+            return
+
         # credentials = {'username': user.username, 'password': user.username}
         credentials = {'username': user.username, 'password': user.cached_raw_password}
 
         # Make all requests in the context of a logged in session.
         self.client.login(**credentials)
+        self.remember_session(user, self.client)
+
+    def session_logout(self):
+        """
+        Log the client out and forget the cached cookies of its session
+        """
+        session_key = self.client.cookies.get(settings.SESSION_COOKIE_NAME)
+        if session_key is not None:
+            for key, cookies in list(self._session_cookies.items()):
+                if cookies.get(settings.SESSION_COOKIE_NAME) == session_key.value:
+                    del self._session_cookies[key]
+        self.client.logout()
 
     def oauth_credential(self, user):
         """
@@ -105,8 +263,7 @@ class SchemaTestCase(APITestCaseWithAssertions):
         check unauthorized requests)
         """
         if user:
-            token = user.accesstoken_set.first()
-            self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token.token)
+            self.client.credentials(HTTP_AUTHORIZATION=token_pool.bearer(user))
         else:
             self.client.credentials()
 
@@ -116,9 +273,27 @@ class SchemaTestCase(APITestCaseWithAssertions):
         """
         if user:
             self.client.credentials(HTTP_AUTHORIZATION=basic_auth_str(user.username, user.cached_raw_password))
+        else:
+            self.client.credentials()
+
+    def check_request_data(self, data, request_object_name, validate_mode=VALIDATE_FIRST):
+        """
+        Checks the data being sent matches the schema, a list is treated as a bulk request
+        """
+        return validate_data(self.schema.validators[request_object_name], data, validate_mode,
+                             many=isinstance(data, list), check_types=self.CHECK_TYPES)
+
+    def check_response_data(self, response, response_object_name, validate_mode=VALIDATE_FIRST):
+        """
+        Checks the response matches the schema. For a list (or paginated `results`)
+        `validate_mode` decides whether the first, all or a sample of the elements are checked.
+        The ValidationReport is stored on the response as `schema_report`.
+        """
+        if self.VALIDATE_RENDERED:
+            return self.check_response_content(response, response_object_name, validate_mode)
 
-    def check_response_data(self, response, response_object_name):
         results_data = response.data
+        many = False
 
         if "results" in response.data or isinstance(response.data, list):  # If multiple objects returned
             if "results" in response.data:
@@ -128,9 +303,169 @@ class SchemaTestCase(APITestCaseWithAssertions):
 
             if len(results_data) == 0:
                 raise self.failureException("No data to compare response")
-            results_data = results_data[0]
+            many = True
 
-        self.check_schema_keys(results_data, self.schema_objects[response_object_name])
+        report = validate_data(self.schema.validators[response_object_name], results_data, validate_mode,
+                               many=many, check_types=self.CHECK_TYPES)
+        response.schema_report = report
+        return report
+
+    def check_response_content(self, response, response_object_name, validate_mode=VALIDATE_FIRST):
+        """
+        Checks the rendered response body matches the schema. The body is parsed
+        incrementally, one element of a list response at a time, so large
+        responses are validated in bounded memory.
+        """
+        report = validate_stream(self.schema.validators[response_object_name], iter_chunks(response),
+                                 validate_mode, check_types=self.CHECK_TYPES)
+        response.schema_report = report
+        return report
+
+    def perform_request(self, method, url, *args, **kwargs):
+        """
+        Sends a request through the test client, the RequestMetrics (time,
+        SQL statements, payload size) are stored on the response as `metrics`
+        """
+        send = getattr(self.client, method)
+        return self.measure_request(method, url, lambda: send(url, *args, **kwargs))
+
+    def profiling(self, name):
+        """
+        Whether the PROFILE_<name> probe is on, the REST_APITEST_PROFILE_<name>
+        environment variable ("1" or "0") overrides the class attribute
+        """
+        value = os.environ.get('REST_APITEST_PROFILE_' + name)
+        if value is None:
+            return getattr(self, 'PROFILE_' + name)
+        return value.lower() in ('1', 'true', 'yes')
+
+    def measure_request(self, method, url, send):
+        if self.profiling('CPU'):
+            send = profile_cpu(send)
+        if self.profiling('PHASES'):
+            send = time_phases(send)
+        if self.profiling('MEMORY'):
+            with MemoryProbe() as probe:
+                response, metrics = measure(method, url, send)
+            response.memory = probe
+            report_path = getattr(settings, 'API_MEMORY_REPORT', None)
+            if report_path is not None and probe.peak is not None:
+                record_memory(report_path, endpoint_key(method, url, response), probe)
+        else:
+            response, metrics = measure(method, url, send)
+        response.metrics = metrics
+        self._requests.append((method, url, metrics.elapsed))
+        profile_dir = getattr(settings, 'API_PROFILE_DIR', None)
+        if profile_dir is not None and getattr(response, 'cpu_profile', None) is not None:
+            record_cpu(profile_dir, endpoint_key(method, url, response), response.cpu_profile)
+        phase_report = getattr(settings, 'API_PHASE_REPORT', None)
+        if phase_report is not None and getattr(response, 'phases', None) is not None:
+            record_phases(phase_report, endpoint_key(method, url, response), self.auth_type, response.phases)
+        return response
+
+    def check_budgets(self, response, max_ms=None, max_queries=None, max_bytes=None):
+        """
+        Fails with a breakdown of the request when it exceeded one of its budgets.
+        A streaming response not yet read to the end is drained to count its bytes for max_bytes.
+        """
+        if max_bytes is not None and response.metrics.pending:
+            for _ in response.streaming_content:
+                pass
+        violations = budget_violations(response.metrics, max_ms, max_queries, max_bytes)
+        if violations:
+            raise self.failureException(budget_report(response.metrics, violations))
+
+    def check_n_plus_one(self, response):
+        """
+        Flags SQL statement shapes that ran at least once per row of a list response
+        """
+        report = getattr(response, 'schema_report', None)
+        if not self.N_PLUS_ONE or report is None or not report.many:
+            return
+        repeated = repeated_statements(response.metrics.queries, report.total)
+        if repeated:
+            message = u"Possible N+1 queries for GET {0}, {1} rows returned:\n{2}".format(
+                response.metrics.url, report.total,
+                u"\n".join(u"  {0}x {1}".format(count, shape) for shape, count in repeated))
+            if self.N_PLUS_ONE == 'fail':
+                raise self.failureException(message)
+            warnings.warn(message)
+
+    def assertQueriesDoNotScale(self, url, create_rows, user, parameters=None, sizes=(2, 10)):
+        """
+        Calls a list endpoint at two fixture sizes and fails if the number of
+        queries grows with the number of rows.
+        `create_rows(count)` must add `count` more rows to what the endpoint
+        returns; it is called with sizes[0], then with sizes[1] - sizes[0].
+        """
+        small, large = sizes
+        parameters = parameters or {}
+        create_rows(small)
+        self.add_credentials(user)
+        small_response = self.perform_request('get', url, parameters)
+        self.assertValidJSONResponse(small_response)
+
+        create_rows(large - small)
+        self.add_credentials(user)
+        large_response = self.perform_request('get', url, parameters)
+        self.assertValidJSONResponse(large_response)
+
+        scaling = scaling_statements(small_response.metrics.queries, large_response.metrics.queries)
+        if scaling:
+            raise self.failureException(u"Query count for GET {0} grows with the number of rows:\n{1}".format(
+                url, u"\n".join(u"  {0} rows: {1}x, {2} rows: {3}x {4}".format(small, small_count, large,
+                                                                               large_count, shape)
+                                 for shape, small_count, large_count in scaling)))
+
+    def baseline_mode(self):
+        """
+        BASELINE_MODE, unless the REST_APITEST_BASELINE_MODE environment variable
+        is set ("none" or an empty value turn the comparison off)
+        """
+        mode = os.environ.get('REST_APITEST_BASELINE_MODE')
+        if mode is None:
+            return self.BASELINE_MODE
+        return None if mode.lower() in ('', 'none') else mode.lower()
+
+    def assertNoRegression(self, url, user, parameters=None, method='get', data=None, format='json', samples=None):
+        """
+        Sends the same request `samples` times and compares the latencies and
+        query counts with the baseline recorded for this method and url.
+        Records the samples instead when BASELINE_MODE is "record" or the
+        baseline has no entry for the request yet (SchemaTestRunner saves them).
+        """
+        baseline_path = getattr(settings, 'API_BENCHMARK_BASELINE', None)
+        assert baseline_path is not None, u"please set API_BENCHMARK_BASELINE in your project's settings " \
+                                          u"to the path of the baseline file"
+        mode = self.baseline_mode() or 'fail'
+
+        timings = []
+        queries = []
+        for _ in range(samples or self.BASELINE_SAMPLES):
+            self.add_credentials(user)
+            if method == 'get':
+                response = self.perform_request(method, url, parameters or {})
+            else:
+                response = self.perform_request(method, url, data, format=format)
+            timings.append(response.metrics.ms)
+            queries.append(len(response.metrics.queries))
+
+        baseline = get_baseline(baseline_path)
+        entry = baseline.get(method, url)
+        if mode == 'record' or entry is None:
+            baseline.record(method, url, timings, queries)
+            # Workers running in parallel share the file, each appends what it recorded
+            append_partial(baseline_path, {'method': method, 'path': url, 'timings_ms': timings,
+                                           'queries': queries})
+            return
+
+        regressions = compare_samples(entry, timings, queries, self.BASELINE_THRESHOLD, self.BASELINE_ALPHA)
+        if regressions:
+            message = u"Performance regression for {0} {1}:\n{2}".format(
+                method.upper(), url, u"\n".join(u"  " + regression for regression in regressions))
+            if mode == 'fail':
+                raise self.failureException(message)
+            warnings.warn(message)
 
     def assertSchemaGet(
             self,
@@ -138,18 +473,30 @@ class SchemaTestCase(APITestCaseWithAssertions):
             parameters,
             response_object_name,
             user,
-            unauthorized=False):
+            unauthorized=False,
+            validate=VALIDATE_FIRST,
+            max_ms=None,
+            max_queries=None,
+            max_bytes=None):
         """
         Checks GET parameters and results match the schema
+
+        validate: "first", "all" or "sample:N", how many elements of a list response are checked
+        max_ms, max_queries, max_bytes: fail when the request takes longer, runs more
+            SQL queries or returns a bigger payload than this
         """
         self.add_credentials(user)
-        response = self.client.get(url, parameters)
+        response = self.perform_request('get', url, parameters)
         if unauthorized:
             self.assertHttpNotAllowed(response)
         else:
             self.assertValidJSONResponse(response)
-            self.check_response_data(response, response_object_name)
+            self.check_response_data(response, response_object_name, validate)
+            self.check_n_plus_one(response)
+            if self.baseline_mode():
+                self.assertNoRegression(url, user, parameters)
 
+        self.check_budgets(response, max_ms, max_queries, max_bytes)
         return response
 
     def assertSchemaPost(
@@ -161,31 +508,36 @@ class SchemaTestCase(APITestCaseWithAssertions):
             user,
             format="json",
             unauthorized=False,
-            status_OK=False):
+            status_OK=False,
+            validate=VALIDATE_FIRST,
+            max_ms=None,
+            max_queries=None,
+            max_bytes=None):
         """
         Checks POST data and results match schema
 
         status_OK: used for non-standard POST requests that do not return 201,
             e.g. if creating a custom route that uses POST
+        validate: "first", "all" or "sample:N", how many elements of a bulk create are checked
+        max_ms, max_queries, max_bytes: fail when the request takes longer, runs more
+            SQL queries or returns a bigger payload than this
         """
-        if isinstance(data, list):  # Check first object if this is a bulk create
-            self.check_schema_keys(data[0], self.schema_objects[request_object_name])
-        else:
-            self.check_schema_keys(data, self.schema_objects[request_object_name])
+        self.check_request_data(data, request_object_name, validate)
 
         self.add_credentials(user)
-        response = self.client.post(url, data, format=format)
+        response = self.perform_request('post', url, data, format=format)
         if unauthorized:
             self.assertHttpNotAllowed(response)
         elif status_OK:
             self.assertHttpOK(response)
             self.assertTrue(response['Content-Type'].startswith('application/json'))
-            self.check_response_data(response, response_object_name)
+            self.check_response_data(response, response_object_name, validate)
         else:
             self.assertHttpCreated(response)
             self.assertTrue(response['Content-Type'].startswith('application/json'))
-            self.check_response_data(response, response_object_name)
+            self.check_response_data(response, response_object_name, validate)
 
+        self.check_budgets(response, max_ms, max_queries, max_bytes)
         return response
 
     def assertSchemaPatch(
@@ -196,20 +548,29 @@ class SchemaTestCase(APITestCaseWithAssertions):
             data,
             user,
             format="json",
-            unauthorized=False):
+            unauthorized=False,
+            validate=VALIDATE_FIRST,
+            max_ms=None,
+            max_queries=None,
+            max_bytes=None):
         """
         Checks PATCH data and results match schema
+
+        validate: "first", "all" or "sample:N", how many elements of nested lists are checked
+        max_ms, max_queries, max_bytes: fail when the request takes longer, runs more
+            SQL queries or returns a bigger payload than this
         """
-        self.check_schema_keys(data, self.schema_objects[request_object_name])
+        self.check_request_data(data, request_object_name, validate)
 
         self.add_credentials(user)
-        response = self.client.patch(url, data, format=format)
+        response = self.perform_request('patch', url, data, format=format)
         if unauthorized:
             self.assertHttpNotAllowed(response)
         else:
             self.assertValidJSONResponse(response)
-            self.check_response_data(response, response_object_name)
+            self.check_response_data(response, response_object_name, validate)
 
+        self.check_budgets(response, max_ms, max_queries, max_bytes)
         return response
 
     def assertSchemaPut(
@@ -221,18 +582,25 @@ class SchemaTestCase(APITestCaseWithAssertions):
             user,
             format="json",
             unauthorized=False,
-            forbidden=False):
+            forbidden=False,
+            validate=VALIDATE_FIRST,
+            max_ms=None,
+            max_queries=None,
+            max_bytes=None):
         """
         Assumes PUT is used for bulk updates, not single updates.
         Runs a PUT request and checks the PUT data and results match the
-        schema for bulk updates. Assumes that all objects sent in a bulk
-        update are identical, and hence only checks that the first one
-        matches the schema.
+        schema for bulk updates. By default assumes that all objects sent in
+        a bulk update are identical, and hence only checks that the first one
+        matches the schema; pass validate="all" or "sample:N" to check more.
+
+        max_ms, max_queries, max_bytes: fail when the request takes longer, runs more
+            SQL queries or returns a bigger payload than this
         """
-        self.check_schema_keys(data[0], self.schema_objects[request_object_name])
+        self.check_request_data(data, request_object_name, validate)
 
         self.add_credentials(user)
-        response = self.client.put(url, data, format=format)
+        response = self.perform_request('put', url, data, format=format)
         if forbidden:
             # Attempting to update an object that isn't yours means it isn't in the queryset. DRF reads this as
             # creating, not updating. Since we have the `allow_add_remove` option set to False, creating isn't
@@ -242,30 +610,171 @@ class SchemaTestCase(APITestCaseWithAssertions):
             self.assertHttpUnauthorized(response)
         else:
             self.assertValidJSONResponse(response)
-            self.check_response_data(response, response_object_name)
+            self.check_response_data(response, response_object_name, validate)
 
+        self.check_budgets(response, max_ms, max_queries, max_bytes)
         return response
 
     def assertSchemaDelete(
             self,
             url,
             user,
-            unauthorized=False):
+            unauthorized=False,
+            max_ms=None,
+            max_queries=None,
+            max_bytes=None):
         """
         Checks DELETE
+
+        max_ms, max_queries, max_bytes: fail when the request takes longer, runs more
+            SQL queries or returns a bigger payload than this
         """
         self.add_credentials(user)
-        response = self.client.delete(url)
+        response = self.perform_request('delete', url)
 
         if unauthorized:
             self.assertHttpNotAllowed(response)
         else:
             self.assertHttpAccepted(response)
 
+        self.check_budgets(response, max_ms, max_queries, max_bytes)
         return response
 
-    def assertPhotoUpload(self):
-        pass
+    def assertSchemaBatch(self, cases, fail=True):
+        """
+        Run many assertSchema* checks and report every failure at once.
+        Each case is a dict with `method` ("get", "post", "put", "patch" or
+        "delete") and the keyword arguments of the matching assertSchema* method.
+        Cases are grouped by `user` so credentials are added once per user.
+        Returns a BatchResult, and fails at the end when `fail` and a case failed.
+        """
+        result = BatchResult()
+        groups = []
+        by_user = {}
+        for index, case in enumerate(cases):
+            case = dict(case)
+            user = case.get('user')
+            key = (type(user), getattr(user, 'pk', user))
+            if key not in by_user:
+                by_user[key] = []
+                groups.append((user, by_user[key]))
+            by_user[key].append((index, case))
+
+        add_credentials = self.add_credentials
+        # The credentials of a group stay on the client for all of its cases
+        self.add_credentials = lambda user: None
+        start = default_timer()
+        try:
+            for user, group in groups:
+                add_credentials(user)
+                for index, case in group:
+                    method = case.pop('method')
+                    try:
+                        response = getattr(self, 'assertSchema' + method.capitalize())(**case)
+                    except AssertionError as error:
+                        result.add(index, case, error=error)
+                    else:
+                        result.add(index, case, response=response)
+        finally:
+            self.add_credentials = add_credentials
+            result.elapsed = default_timer() - start
+        result.entries.sort(key=lambda entry: entry[0])
+
+        if fail and result.failures:
+            raise self.failureException(result.report())
+        return result
+
+    def perform_upload(self, method, url, files, data=None):
+        """
+        Sends a multipart request like `perform_request`, the body is streamed
+        from the file objects in `files` instead of being built in memory
+        """
+        body = MultipartStream(data, files)
+        return self.measure_request(method, url, lambda: self.client.generic(method.upper(), url, **body.environ()))
+
+    def open_upload(self, source):
+        """
+        A file object for an upload source: a path relative to settings.PROJECT_ROOT
+        or a file object such as rest_apitest.uploads.LargeFile
+        """
+        if isinstance(source, six.string_types):
+            return open(settings.PROJECT_ROOT + source, 'rb')
+        source.seek(0)
+        return source
+
+    def close_upload(self, source, upload):
+        """
+        Close a file open_upload opened from a path, file objects given by the caller stay open
+        """
+        if upload is not source:
+            upload.close()
+
+    def uploaded_object(self, obj_to_update, related_media_model=None, related_name=None):
+        """
+        Reload the object storing the uploaded files
+        """
+        if related_media_model and related_name:
+            filters = {
+                related_name: obj_to_update
+            }
+            return related_media_model.objects.filter(**filters)[0]
+        return obj_to_update.__class__.objects.get(pk=obj_to_update.pk)
+
+    def assertStoredFile(self, field_file, source):
+        """
+        Compares a stored file with its source chunk by chunk
+        """
+        field_file.open('rb')
+        try:
+            equal = files_equal(field_file, source)
+        finally:
+            field_file.close()
+        self.assertTrue(equal, u"The stored file {0} differs from the uploaded one".format(field_file.name))
+
+    def benchmark_upload(self, url, user, field_name='video_file', sizes=UPLOAD_SIZES, repeat=1, method='post',
+                         data=None):
+        """
+        Upload generated files of increasing size to `url` the way assertVideoUpload
+        does and return a row per size (see bench.benchmark_upload_sizes), e.g.
+        print(format_upload_table(self.benchmark_upload(url, user)))
+        """
+        self.add_credentials(user)
+        handlers = recording_upload_handlers(settings.FILE_UPLOAD_HANDLERS)
+        with override_settings(FILE_UPLOAD_HANDLERS=handlers):
+            return benchmark_upload_sizes(lambda files: self.perform_upload(method, url, files, data),
+                                          field_name, sizes, repeat)
+
+    def assertPhotoUpload(
+            self,
+            url,
+            obj_to_update,
+            user,
+            path_to_image,
+            field_name='image',
+            related_media_model=None,
+            related_name=None,
+            unauthorized=False,
+            method='post'
+    ):
+        """
+        Checks that the image is uploaded to `field_name` and saved unchanged.
+        `path_to_image` is relative to settings.PROJECT_ROOT, or a file object.
+        See assertVideoUpload for `related_media_model` and `related_name`.
+        """
+        self.add_credentials(user)
+        image = self.open_upload(path_to_image)
+        try:
+            response = self.perform_upload(method, url, {field_name: image})
+
+            if unauthorized:
+                self.assertHttpNotAllowed(response)
+            else:
+                self.assertIn(response.status_code, [200, 201], response)
+                obj_to_update = self.uploaded_object(obj_to_update, related_media_model, related_name)
+                self.assertStoredFile(getattr(obj_to_update, field_name), image)
+        finally:
+            self.close_upload(path_to_image, image)
+        return response
 
     def assertVideoUpload(
             self,
@@ -285,45 +794,29 @@ class SchemaTestCase(APITestCaseWithAssertions):
         files (e.g., there is a Media model that has a relation to the model
         being updated), pass that model and the keyword field on that model
         that relates to the model being updated
+        The video is streamed from disk (or a file object) and compared with
+        the stored files in chunks, so large videos are never held in memory.
         """
         self.add_credentials(user)
-        kwargs = {
-            "data": {
-                'video_file': open(settings.PROJECT_ROOT + path_to_video, 'rb')
-            },
-            'format': 'multipart'
-        }
-        response = self.client.post(url, **kwargs)
-
-        if unauthorized:
-            self.assertHttpForbidden(response)
-        else:
-            self.assertHttpCreated(response)
-            self.assertTrue(response['Content-Type'].startswith('application/json'))
+        video = self.open_upload(path_to_video)
+        try:
+            response = self.perform_upload('post', url, {'video_file': video})
 
-            # Check the video and thumbnail are saved
-            if related_media_model and related_name:
-                filters = {
-                    related_name: obj_to_update
-                }
-                obj_to_update = related_media_model.objects.filter(**filters)[0]
+            if unauthorized:
+                self.assertHttpForbidden(response)
             else:
-                obj_to_update = obj_to_update.__class__.objects.get(pk=obj_to_update.pk)
-            original_file_field_name = getattr(obj_to_update, "original_file_name", "original_file")
-            original_file = getattr(obj_to_update, original_file_field_name)
-            self.assertEqual(
-                original_file.file.read(),
-                open(settings.PROJECT_ROOT + path_to_video, 'r').read()
-            )
-            self.assertEqual(
-                obj_to_update.thumbnail.file.read(),
-                open(settings.PROJECT_ROOT + path_to_thumbnail, 'r').read()
-            )
-
-
-
-
-
-
-
-
+                self.assertHttpCreated(response)
+                self.assertTrue(response['Content-Type'].startswith('application/json'))
+
+                # Check the video and thumbnail are saved
+                obj_to_update = self.uploaded_object(obj_to_update, related_media_model, related_name)
+                original_file_field_name = getattr(obj_to_update, "original_file_name", "original_file")
+                self.assertStoredFile(getattr(obj_to_update, original_file_field_name), video)
+                thumbnail = self.open_upload(path_to_thumbnail)
+                try:
+                    self.assertStoredFile(obj_to_update.thumbnail, thumbnail)
+                finally:
+                    self.close_upload(path_to_thumbnail, thumbnail)
+        finally:
+            self.close_upload(path_to_video, video)
+        return response
@@ -0,0 +1,116 @@
+# coding=utf-8
+import json
+from django.conf import settings
+from django.db import connection
+from django.utils.six.moves import input
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment
+from rest_framework.test import APIClient
+from rest_apitest.schema import registry
+from rest_apitest.bench import METHODS, Baseline, compare_results, run_benchmarks, write_results
+
+
+class Command(BaseCommand):
+    help = u"Benchmark the endpoints listed in the `urls` section of API_SCHEMA through the APIClient"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--warmup', type=int, default=5,
+                            help=u"unmeasured requests per endpoint")
+        parser.add_argument('--iterations', type=int, default=50,
+                            help=u"measured requests per endpoint")
+        parser.add_argument('--methods', default='get',
+                            help=u"comma separated methods to benchmark, e.g. get,post")
+        parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                            help=u"value for a `:name` placeholder in schema urls")
+        parser.add_argument('--prefix', default='/',
+                            help=u"prefix added to every schema url")
+        parser.add_argument('--user', help=u"username to authenticate the requests as")
+        parser.add_argument('--data', help=u'JSON file mapping "METHOD url" to a request body')
+        parser.add_argument('--no-allocations', action='store_true',
+                            help=u"skip the extra request measuring allocations")
+        parser.add_argument('--output', help=u"write the results as JSON to this file")
+        parser.add_argument('--baseline', help=u"compare the results with this baseline file")
+        parser.add_argument('--update-baseline', action='store_true',
+                            help=u"write the results into the baseline file instead of comparing")
+        parser.add_argument('--threshold', type=float, default=1.25,
+                            help=u"slowdown of the median latency that counts as a regression")
+        parser.add_argument('--alpha', type=float, default=0.01,
+                            help=u"significance level of the regression test")
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive', default=True,
+                            help=u"do not ask for confirmation before sending writes to the database")
+
+    def handle(self, *args, **options):
+        schema_path = getattr(settings, 'API_SCHEMA', None)
+        if schema_path is None:
+            raise CommandError(u"please set API_SCHEMA in your project's settings")
+        schema = registry.get(schema_path)
+
+        methods = [method.strip().lower() for method in options['methods'].split(',') if method.strip()]
+        unknown = set(methods).difference(METHODS)
+        if unknown:
+            raise CommandError(u"unknown methods: {0}".format(', '.join(sorted(unknown))))
+
+        parameters = {}
+        for param in options['param']:
+            name, _, value = param.partition('=')
+            parameters[name] = value
+
+        request_data = None
+        if options['data']:
+            with open(options['data']) as file:
+                request_data = json.load(file)
+
+        writes = [method for method in methods if method != 'get']
+        if writes:
+            database = connection.settings_dict['NAME']
+            self.stderr.write(u"{0} requests write to the configured database {1!r}".format(
+                '/'.join(method.upper() for method in writes), database))
+            if options['interactive'] and input(u"Type 'yes' to continue: ") != 'yes':
+                raise CommandError(u"benchmark cancelled")
+
+        setup_test_environment()
+        client = APIClient()
+        if options['user']:
+            client.force_authenticate(get_user_model().objects.get(username=options['user']))
+
+        results = run_benchmarks(client, schema, parameters, options['prefix'], methods, request_data,
+                                 options['warmup'], options['iterations'], not options['no_allocations'])
+
+        for result in results['endpoints']:
+            line = (u"{method:6} {path:40} p50 {p50_ms:>8}ms  p95 {p95_ms:>8}ms  "
+                    u"p99 {p99_ms:>8}ms  {rps:>8} req/s  status {status_codes}".format(
+                        **dict(result, method=result['method'].upper())))
+            if 'alloc_method' in result:
+                # New tracemalloc blocks, or new gc-tracked objects when measured from the RSS
+                line += u"  alloc peak {0} B net {1} B {2:+d} {3}".format(
+                    result['peak_alloc_bytes'], result['net_alloc_bytes'], result['net_alloc_blocks'],
+                    'blocks' if result['alloc_method'] == 'tracemalloc' else 'objects')
+            self.stdout.write(line)
+        for skipped in results['skipped']:
+            self.stdout.write(u"skipped {0} {1}: {2}".format(skipped['method'].upper(), skipped['url'],
+                                                             skipped['reason']))
+        if options['output']:
+            write_results(results, options['output'])
+            self.stdout.write(u"results written to {0}".format(options['output']))
+
+        # The latencies of error responses say nothing about the endpoint
+        failed = [u"{0} {1} ({2})".format(result['method'].upper(), result['path'],
+                                          ', '.join(str(code) for code in result['status_codes']))
+                  for result in results['endpoints'] if any(not 200 <= code < 300 for code in result['status_codes'])]
+        if failed:
+            raise CommandError(u"non-2xx responses from: {0}".format('; '.join(failed)))
+
+        if options['baseline']:
+            baseline = Baseline(options['baseline'])
+            if options['update_baseline']:
+                baseline.record_results(results)
+                baseline.save()
+                self.stdout.write(u"baseline written to {0}".format(options['baseline']))
+                return
+            regressed = compare_results(baseline, results, options['threshold'], options['alpha'])
+            for key in sorted(regressed):
+                for regression in regressed[key]:
+                    self.stdout.write(u"REGRESSION {0}: {1}".format(key, regression))
+            if regressed:
+                raise CommandError(u"{0} endpoint(s) regressed".format(len(regressed)))
@@ -0,0 +1,177 @@
+# coding=utf-8
+"""
+Measurements taken around each request issued by SchemaTestCase
+"""
+import re
+from collections import Counter
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.test.utils import CaptureQueriesContext
+
+try:
+    from time import monotonic as clock
+except ImportError:  # Python 2 has no monotonic clock, time.time() is skewed if the system clock is changed
+    from timeit import default_timer as clock
+
+
+class QueryRecorder(object):
+    """
+    Records the SQL run on a connection while active. Uses the connection's
+    execute wrapper where Django provides one (2.0+) and falls back to
+    CaptureQueriesContext on older versions.
+    """
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.connection = connections[using]
+        self.statements = []
+        self._context = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.statements.append(sql)
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        if hasattr(self.connection, 'execute_wrapper'):
+            self._context = self.connection.execute_wrapper(self)
+        else:
+            self._context = CaptureQueriesContext(self.connection)
+        self._context.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._context.__exit__(exc_type, exc_value, traceback)
+        if isinstance(self._context, CaptureQueriesContext):
+            self.statements = [query['sql'] for query in self._context.captured_queries]
+
+    def __len__(self):
+        return len(self.statements)
+
+
+class RequestMetrics(object):
+    """
+    Wall time, SQL statements and payload size of one request. The bytes of
+    a streaming response are counted as it is read, `pending` is True until
+    it has been read to the end.
+    """
+    __slots__ = ('method', 'url', 'status_code', 'elapsed', 'queries', 'bytes', 'pending')
+
+    def __init__(self, method, url):
+        self.method = method
+        self.url = url
+        self.status_code = None
+        self.elapsed = 0.0
+        self.queries = []
+        self.bytes = 0
+        self.pending = False
+
+    @property
+    def ms(self):
+        return self.elapsed * 1000
+
+    def __repr__(self):
+        return '<RequestMetrics {0} {1} {2:.1f}ms queries={3} bytes={4}>'.format(
+            self.method.upper(), self.url, self.ms, len(self.queries), self.bytes)
+
+
+def counted(chunks, metrics):
+    for chunk in chunks:
+        metrics.bytes += len(chunk)
+        yield chunk
+    metrics.pending = False
+
+
+def count_bytes(response, metrics):
+    """
+    Record the size of the response payload. A streaming response is not
+    read here: its chunks are counted as the caller consumes them.
+    """
+    if getattr(response, 'streaming', False):
+        metrics.pending = True
+        response.streaming_content = counted(response.streaming_content, metrics)
+    else:
+        metrics.bytes = len(response.content)
+
+
+def measure(method, url, send, using=DEFAULT_DB_ALIAS):
+    """
+    Call `send()` and return `(response, RequestMetrics)`. The request is timed
+    with time.monotonic, or the wall clock on Python 2.
+    """
+    metrics = RequestMetrics(method, url)
+    with QueryRecorder(using) as recorder:
+        start = clock()
+        response = send()
+        metrics.elapsed = clock() - start
+    metrics.queries = recorder.statements
+    metrics.status_code = response.status_code
+    count_bytes(response, metrics)
+    return response, metrics
+
+
+def budget_violations(metrics, max_ms=None, max_queries=None, max_bytes=None):
+    """
+    Return a description of every budget `metrics` exceeds
+    """
+    violations = []
+    if max_ms is not None and metrics.ms > max_ms:
+        violations.append(u"time {0:.1f}ms > max_ms={1}".format(metrics.ms, max_ms))
+    if max_queries is not None and len(metrics.queries) > max_queries:
+        violations.append(u"queries {0} > max_queries={1}".format(len(metrics.queries), max_queries))
+    if max_bytes is not None and metrics.bytes > max_bytes:
+        violations.append(u"payload {0} bytes > max_bytes={1}".format(metrics.bytes, max_bytes))
+    return violations
+
+
+def budget_report(metrics, violations):
+    """
+    The failure message for a request that exceeded its budgets
+    """
+    lines = [u"Request budget exceeded for {0} {1}:".format(metrics.method.upper(), metrics.url)]
+    lines.extend(u"  {0}".format(violation) for violation in violations)
+    lines.append(u"  measured: {0:.1f}ms, {1} queries, {2} bytes, status {3}".format(
+        metrics.ms, len(metrics.queries), metrics.bytes, metrics.status_code))
+    for index, sql in enumerate(metrics.queries, 1):
+        lines.append(u"  {0}. {1}".format(index, sql))
+    return u"\n".join(lines)
+
+
+STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL_RE = re.compile(r"\b-?\d+(?:\.\d+)?\b")
+PLACEHOLDER_RE = re.compile(r"%s|\?")
+IN_LIST_RE = re.compile(r"\bIN\s*\((?:\s*\?\s*,?)+\)", re.IGNORECASE)
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    """
+    The shape of a SQL statement: literals and placeholders become `?` and
+    `IN (...)` lists collapse, so per-row lookups share a fingerprint
+    """
+    sql = STRING_LITERAL_RE.sub('?', sql)
+    sql = NUMBER_LITERAL_RE.sub('?', sql)
+    sql = PLACEHOLDER_RE.sub('?', sql)
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    return WHITESPACE_RE.sub(' ', sql).strip()
+
+
+def statement_counts(queries):
+    return Counter(fingerprint(sql) for sql in queries)
+
+
+def repeated_statements(queries, rows):
+    """
+    Statement shapes run at least once per returned row, the signature of an
+    unbatched related object lookup. Returns `[(fingerprint, count)]`.
+    """
+    if rows < 2:
+        return []
+    return [(shape, count) for shape, count in statement_counts(queries).most_common() if count >= rows]
+
+
+def scaling_statements(small_queries, large_queries):
+    """
+    Statement shapes that ran more often in the larger request.
+    Returns `[(fingerprint, small count, large count)]`.
+    """
+    small = statement_counts(small_queries)
+    large = statement_counts(large_queries)
+    return [(shape, small.get(shape, 0), count) for shape, count in large.most_common()
+            if count > small.get(shape, 0)]
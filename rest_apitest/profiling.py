@@ -0,0 +1,544 @@
+# coding=utf-8
+"""
+Opt-in profiling of the requests issued by SchemaTestCase
+
+Each probe wraps one request. What it finds is stored on the response and,
+when the matching setting names a report file, appended to `<report>.partial`
+so parallel workers can share it. SchemaTestRunner folds the lines into the
+report after the run.
+"""
+import gc
+import io
+import copy
+import os
+import re
+import sys
+import glob
+import json
+import time
+import pstats
+import cProfile
+import threading
+from timeit import default_timer
+from collections import Counter
+from sharding import append_partial, read_partial
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def endpoint_key(method, url, response=None):
+    """
+    "METHOD view-name" for a request, the path when the url did not resolve
+    """
+    try:
+        name = response.resolver_match.view_name
+    except Exception:
+        name = None
+    return u'{0} {1}'.format(method.upper(), name or url)
+
+
+def max_rss():
+    """
+    The process' peak resident set size in bytes, None where unknown
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if os.uname()[0] == 'Darwin' else rss * 1024
+
+
+def current_rss():
+    """
+    The process' current resident set size in bytes, None where unknown (not Linux)
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError, AttributeError):
+        return None
+
+
+def object_counts():
+    """
+    Number of gc-tracked objects per type name
+    """
+    return Counter(type(obj).__name__ for obj in gc.get_objects())
+
+
+class MemoryProbe(object):
+    """
+    tracemalloc snapshots around a request: peak and net bytes allocated and
+    the `top` source lines that allocated the most.
+    Where tracemalloc is not available (Python 2) the process is measured
+    instead: `peak` is how far the request raised the peak RSS above its
+    previous high (often 0 once the process is warm), `net` the growth of the
+    current RSS and `sites` the types whose gc-tracked objects grew the most,
+    with a size of 0. `method` is "tracemalloc" or "rss".
+    Both slow the request down several times, so leave budgets off while profiling.
+    """
+    def __init__(self, top=10, frames=1):
+        self.top = top
+        self.frames = frames
+        self.method = 'tracemalloc' if tracemalloc is not None else 'rss'
+        self.peak = None
+        self.net = None
+        self.sites = []
+
+    def __enter__(self):
+        gc.collect()
+        if tracemalloc is None:
+            self._counts = object_counts()
+            self._rss = current_rss()
+            self._max_rss = max_rss()
+            return self
+        # The peak is kept since tracing started, so trace this request only
+        # and resume a session that was already running afterwards
+        self._resume = tracemalloc.get_traceback_limit() if tracemalloc.is_tracing() else None
+        if self._resume is not None:
+            tracemalloc.stop()
+        tracemalloc.start(self.frames)
+        self._before = tracemalloc.take_snapshot()
+        self._current = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if tracemalloc is None:
+            self.measure_process()
+            return
+        try:
+            current, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+            if self._resume is not None:
+                tracemalloc.start(self._resume)
+        self.peak = peak - self._current
+        self.net = current - self._current
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        stats = after.filter_traces(ignore).compare_to(self._before.filter_traces(ignore), 'lineno')
+        self.sites = [(str(stat.traceback[0]), stat.size_diff, stat.count_diff)
+                      for stat in stats[:self.top] if stat.size_diff > 0]
+
+    def measure_process(self):
+        gc.collect()
+        rss = current_rss()
+        peak = max_rss()
+        counts = object_counts()
+        self.net = rss - self._rss if rss is not None and self._rss is not None else 0
+        if peak is not None:
+            self.peak = max(peak - self._max_rss, self.net)
+        counts.subtract(self._counts)
+        self.sites = [(u'{0} objects'.format(name), 0, count) for name, count in counts.most_common(self.top)
+                      if count > 0]
+
+    def as_dict(self):
+        return {'peak_bytes': self.peak, 'net_bytes': self.net, 'sites': self.sites}
+
+
+def record_memory(path, key, probe):
+    append_partial(path, dict(probe.as_dict(), endpoint=key))
+
+
+class MemoryReport(object):
+    """
+    Memory cost per endpoint over a test run, ranked by peak bytes
+    """
+    def __init__(self, top=10):
+        self.top = top
+        self.endpoints = {}
+
+    def add(self, key, peak_bytes, net_bytes, sites):
+        if peak_bytes is None:
+            return
+        entry = self.endpoints.setdefault(key, {'requests': 0, 'max_peak_bytes': 0, 'total_peak_bytes': 0,
+                                                'total_net_bytes': 0, 'sites': {}})
+        entry['requests'] += 1
+        entry['max_peak_bytes'] = max(entry['max_peak_bytes'], peak_bytes)
+        entry['total_peak_bytes'] += peak_bytes
+        entry['total_net_bytes'] += net_bytes
+        for site, size, count in sites:
+            totals = entry['sites'].setdefault(site, [0, 0])
+            totals[0] += size
+            totals[1] += count
+
+    def merge_partial(self, path):
+        for entry in read_partial(path):
+            self.add(entry['endpoint'], entry['peak_bytes'], entry['net_bytes'], entry['sites'])
+
+    def ranked(self):
+        """
+        One dict per endpoint, the most memory hungry first
+        """
+        rows = []
+        for key, entry in self.endpoints.items():
+            sites = sorted(entry['sites'].items(), key=lambda site: (-site[1][0], -site[1][1], site[0]))[:self.top]
+            rows.append({
+                'endpoint': key,
+                'requests': entry['requests'],
+                'max_peak_bytes': entry['max_peak_bytes'],
+                'mean_peak_bytes': entry['total_peak_bytes'] // entry['requests'],
+                'mean_net_bytes': entry['total_net_bytes'] // entry['requests'],
+                'top_sites': [{'site': site, 'bytes': size, 'count': count} for site, (size, count) in sites],
+            })
+        return sorted(rows, key=lambda row: (-row['max_peak_bytes'], row['endpoint']))
+
+    def save(self, path):
+        with open(path, 'w') as file:
+            json.dump({'endpoints': self.ranked()}, file, indent=2, sort_keys=True)
+
+    def format(self, limit=10):
+        lines = [u'{0:>12} {1:>12} {2:>8}  {3}'.format('max peak KB', 'mean net KB', 'requests', 'endpoint')]
+        for row in self.ranked()[:limit]:
+            lines.append(u'{0:>12.1f} {1:>12.1f} {2:>8}  {3}'.format(
+                row['max_peak_bytes'] / 1024.0, row['mean_net_bytes'] / 1024.0, row['requests'], row['endpoint']))
+            if row['top_sites']:
+                site = row['top_sites'][0]
+                if site['bytes']:
+                    amount = u'{0:.1f} KB'.format(site['bytes'] / 1024.0)
+                else:
+                    amount = u'+{0}'.format(site['count'])
+                lines.append(u'{0:>35}  top: {1} ({2})'.format('', site['site'], amount))
+        return u'\n'.join(lines)
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples the stack of one thread every `interval` seconds and counts the
+    stacks in collapsed form ("outer;inner;innermost"), leaving out the
+    outermost `base` frames
+    """
+    def __init__(self, thread_id, interval=0.001, base=0):
+        super(StackSampler, self).__init__()
+        self.daemon = True
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._base = base
+
+    def frames(self):
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(u'{0}:{1}'.format(os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def run(self):
+        while not self._stopped.is_set():
+            stack = self.frames()[self._base:]
+            if stack:
+                self.stacks[u';'.join(stack)] += 1
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class CPUProbe(object):
+    """
+    cProfile and a stack sampler around a request on the current thread.
+    `stats` is the pstats.Stats of the request, `stacks` the sampled collapsed
+    stacks. Both slow the request down, so leave budgets off while profiling.
+    """
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.stats = None
+        self.stacks = Counter()
+
+    def __enter__(self):
+        # Samples start below the frame that entered the probe
+        depth = 0
+        frame = sys._getframe(1)
+        while frame is not None:
+            depth += 1
+            frame = frame.f_back
+        self._sampler = StackSampler(threading.current_thread().ident, self.interval, depth)
+        self._profile = cProfile.Profile()
+        self._sampler.start()
+        self._profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._profile.disable()
+        self._sampler.stop()
+        self.stats = pstats.Stats(self._profile)
+        self.stacks = self._sampler.stacks
+
+
+def profile_cpu(send):
+    """
+    Wrap a `send()` so the response it returns carries its CPUProbe as `cpu_profile`
+    """
+    def profiled():
+        with CPUProbe() as probe:
+            response = send()
+        response.cpu_profile = probe
+        return response
+    return profiled
+
+
+# endpoint key -> (pstats.Stats, Counter of collapsed stacks) of this process
+_cpu_profiles = {}
+_cpu_profiles_lock = threading.Lock()
+
+
+def profile_name(key):
+    return re.sub(r'[^\w.-]+', '_', key).strip('_')
+
+
+def write_folded(path, stacks):
+    with io.open(path, 'w', encoding='utf-8') as file:
+        for stack, count in sorted(stacks.items()):
+            file.write(u'{0} {1}\n'.format(stack, count))
+
+
+def read_folded(path):
+    stacks = Counter()
+    with io.open(path, encoding='utf-8') as file:
+        for line in file:
+            stack, _, count = line.rstrip(u'\n').rpartition(u' ')
+            if stack:
+                stacks[stack] += int(count)
+    return stacks
+
+
+def copy_stats(stats):
+    """
+    A pstats.Stats that can be added to without changing `stats`
+    (Python 2 cannot build one from another Stats or from nothing)
+    """
+    duplicate = copy.copy(stats)
+    duplicate.stats = dict(stats.stats)
+    duplicate.files = list(stats.files)
+    duplicate.top_level = copy.copy(stats.top_level)
+    return duplicate
+
+
+def record_cpu(directory, key, probe):
+    """
+    Add a request's profile to its endpoint's totals for this process and
+    write them to `<endpoint>.<pid>.prof.part` and `.folded.part` in `directory`
+    """
+    with _cpu_profiles_lock:
+        stats, stacks = _cpu_profiles.get(key, (None, Counter()))
+        if stats is None:
+            # The first probe's stats stay the profile of its own request
+            stats = copy_stats(probe.stats)
+        else:
+            stats.add(probe.stats)
+        stacks.update(probe.stacks)
+        _cpu_profiles[key] = (stats, stacks)
+        base = os.path.join(directory, u'{0}.{1}'.format(profile_name(key), os.getpid()))
+        stats.dump_stats(base + '.prof.part')
+        write_folded(base + '.folded.part', stacks)
+
+
+def merge_cpu_profiles(directory, limit=10):
+    """
+    Merge the per-process parts into `<endpoint>.prof` (pstats) and
+    `<endpoint>.folded` (collapsed stacks, for flamegraph.pl or speedscope),
+    write `summary.txt` with the hottest functions of each endpoint and return its text
+    """
+    parts = {}
+    for path in glob.glob(os.path.join(directory, '*.prof.part')):
+        name = os.path.basename(path)[:-len('.prof.part')].rsplit('.', 1)[0]
+        parts.setdefault(name, []).append(path)
+
+    summary = []
+    for name, paths in sorted(parts.items()):
+        stats = pstats.Stats(*paths)
+        stats.dump_stats(os.path.join(directory, name + '.prof'))
+        stacks = Counter()
+        for path in paths:
+            folded = path[:-len('.prof.part')] + '.folded.part'
+            if os.path.exists(folded):
+                stacks.update(read_folded(folded))
+                os.remove(folded)
+            os.remove(path)
+        write_folded(os.path.join(directory, name + '.folded'), stacks)
+
+        rows = sorted(stats.stats.items(), key=lambda item: -item[1][2])[:limit]
+        summary.append(u'{0}: {1} calls, {2:.1f}ms'.format(name, stats.total_calls, stats.total_tt * 1000))
+        for (filename, line, function), (_, calls, tottime, cumtime, _) in rows:
+            summary.append(u'  {0:>9.1f}ms own {1:>9.1f}ms cumulative {2:>7} calls  {3}:{4}({5})'.format(
+                tottime * 1000, cumtime * 1000, calls, os.path.basename(filename), line, function))
+    text = u'\n'.join(summary)
+    if summary:
+        with io.open(os.path.join(directory, 'summary.txt'), 'w', encoding='utf-8') as file:
+            file.write(text)
+    return text
+
+
+# Phases of a DRF request. `checks` are the permission and throttle checks of
+# APIView.initial, `view` the handler without serialization, `other` whatever
+# the test client and middleware spent outside the view and the renderer.
+PHASES = ('authentication', 'checks', 'view', 'serialization', 'rendering', 'other')
+
+_phase_timers = threading.local()
+_phase_probes_lock = threading.Lock()
+_phase_probes_installed = []
+
+
+def _timed_method(function, probe):
+    def timed(*args, **kwargs):
+        timer = getattr(_phase_timers, 'timer', None)
+        if timer is None:
+            return function(*args, **kwargs)
+        return timer.timed(probe, function, *args, **kwargs)
+    timed.__name__ = function.__name__
+    timed.__doc__ = function.__doc__
+    return timed
+
+
+def install_phase_probes():
+    """
+    Wrap APIView.perform_authentication, .initial and .dispatch, Serializer.data,
+    ListSerializer.data and Response.rendered_content (which calls the renderer's
+    render()) once per process. The wrappers only time requests made inside a PhaseTimer.
+    """
+    with _phase_probes_lock:
+        if _phase_probes_installed:
+            return
+        from rest_framework.views import APIView
+        from rest_framework.response import Response
+        from rest_framework.serializers import Serializer, ListSerializer
+        for cls, name, probe in ((APIView, 'perform_authentication', 'authentication'),
+                                 (APIView, 'initial', 'initial'),
+                                 (APIView, 'dispatch', 'dispatch')):
+            setattr(cls, name, _timed_method(cls.__dict__[name], probe))
+        for cls, name, probe in ((Serializer, 'data', 'serialization'),
+                                 (ListSerializer, 'data', 'serialization'),
+                                 (Response, 'rendered_content', 'rendering')):
+            prop = cls.__dict__[name]
+            setattr(cls, name, property(_timed_method(prop.fget, probe), prop.fset, prop.fdel, prop.__doc__))
+        _phase_probes_installed.append(True)
+
+
+class PhaseTimer(object):
+    """
+    Seconds spent in each probe by the requests sent on this thread while the
+    timer is entered. Nested calls of a probe (a serializer's data read inside
+    another's) are counted once.
+    """
+    def __init__(self):
+        self.seconds = {}
+        self.total = None
+        self._active = set()
+
+    def timed(self, probe, function, *args, **kwargs):
+        if probe in self._active:
+            return function(*args, **kwargs)
+        self._active.add(probe)
+        start = default_timer()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.seconds[probe] = self.seconds.get(probe, 0.0) + default_timer() - start
+            self._active.discard(probe)
+
+    def __enter__(self):
+        install_phase_probes()
+        self._previous = getattr(_phase_timers, 'timer', None)
+        _phase_timers.timer = self
+        self._start = default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.total = default_timer() - self._start
+        _phase_timers.timer = self._previous
+
+    def phases(self):
+        """
+        Seconds per phase of PHASES, they add up to the time of the request
+        """
+        seconds = self.seconds.get
+        authentication = seconds('authentication', 0.0)
+        serialization = seconds('serialization', 0.0)
+        rendering = seconds('rendering', 0.0)
+        dispatch = seconds('dispatch', 0.0)
+        initial = seconds('initial', 0.0)
+        return {
+            'authentication': authentication,
+            'checks': max(0.0, initial - authentication),
+            'view': max(0.0, dispatch - initial - serialization),
+            'serialization': serialization,
+            'rendering': rendering,
+            'other': max(0.0, self.total - dispatch - rendering),
+        }
+
+
+def time_phases(send):
+    """
+    Wrap a `send()` so the response it returns carries its seconds per phase as `phases`
+    """
+    def timed():
+        with PhaseTimer() as timer:
+            response = send()
+        response.phases = timer.phases()
+        return response
+    return timed
+
+
+def record_phases(path, key, auth_type, phases):
+    append_partial(path, {'endpoint': key, 'auth_type': auth_type, 'phases': phases})
+
+
+class PhaseReport(object):
+    """
+    Mean milliseconds per phase over a test run, per credential type
+    (basic_credential, session_credential, oauth_credential) and per endpoint
+    """
+    def __init__(self):
+        # group -> {'requests': n, phase: total seconds}
+        self.auth_types = {}
+        self.endpoints = {}
+
+    def add(self, key, auth_type, phases):
+        for groups, group in ((self.auth_types, auth_type), (self.endpoints, key)):
+            entry = groups.setdefault(group, dict(dict.fromkeys(PHASES, 0.0), requests=0))
+            entry['requests'] += 1
+            for phase in PHASES:
+                entry[phase] += phases.get(phase, 0.0)
+
+    def merge_partial(self, path):
+        for entry in read_partial(path):
+            self.add(entry['endpoint'], entry['auth_type'], entry['phases'])
+
+    @staticmethod
+    def means(groups):
+        rows = []
+        for group, entry in groups.items():
+            row = dict((phase, entry[phase] * 1000 / entry['requests']) for phase in PHASES)
+            row['requests'] = entry['requests']
+            row['total'] = sum(row[phase] for phase in PHASES)
+            rows.append((group, row))
+        return sorted(rows, key=lambda item: (-item[1]['total'], item[0]))
+
+    def save(self, path):
+        with open(path, 'w') as file:
+            json.dump({'auth_types': dict(self.means(self.auth_types)),
+                       'endpoints': dict(self.means(self.endpoints))}, file, indent=2, sort_keys=True)
+
+    def format(self, limit=10):
+        header = u''.join(u'{0:>15}'.format(phase) for phase in PHASES + ('total',))
+        lines = [u'{0}{1:>9}  {2}'.format(header, 'requests', 'mean ms per request')]
+        for title, rows in ((u'auth type', self.means(self.auth_types)),
+                            (u'endpoint', self.means(self.endpoints)[:limit])):
+            for group, row in rows:
+                lines.append(u'{0}{1:>9}  {2}: {3}'.format(
+                    u''.join(u'{0:>15.2f}'.format(row[phase]) for phase in PHASES + ('total',)),
+                    row['requests'], title, group))
+        return u'\n'.join(lines)
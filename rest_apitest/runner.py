@@ -0,0 +1,204 @@
+# coding=utf-8
+"""
+A test runner for schema suites
+
+    TEST_RUNNER = 'rest_apitest.runner.SchemaTestRunner'
+"""
+from django.conf import settings
+from django.test.runner import DiscoverRunner, default_test_processes, partition_suite_by_case
+from schema import registry
+from sharding import Timings, lpt_shards, read_partial
+from bench import Baseline
+from profiling import MemoryReport, PhaseReport, merge_cpu_profiles
+
+
+class SchemaTestRunner(DiscoverRunner):
+    """
+    DiscoverRunner that runs test classes in parallel, one process per core
+    unless --parallel (or DJANGO_TEST_PROCESSES) says otherwise.
+
+    The test database is migrated once and every worker gets a clone of it
+    (a file copy on SQLite, the in-memory database is copied by the fork,
+    CREATE DATABASE ... TEMPLATE on PostgreSQL). API_SCHEMA is compiled in the
+    parent before the workers are forked, so they share it instead of each
+    parsing and compiling the file again.
+
+    With settings.API_MEMORY_REPORT set, the requests profiled with
+    SchemaTestCase.PROFILE_MEMORY are ranked per endpoint into that file.
+
+    With settings.API_PROFILE_DIR set, the profiles of the requests made with
+    SchemaTestCase.PROFILE_CPU are merged per endpoint in that directory.
+
+    With settings.API_PHASE_REPORT set, the phases of the requests timed with
+    SchemaTestCase.PROFILE_PHASES are averaged per auth type and per endpoint into that file.
+
+    With settings.API_BENCHMARK_BASELINE set, the samples recorded by
+    SchemaTestCase.assertNoRegression are written into that file.
+
+    With settings.API_TEST_TIMINGS set, the time of every test is recorded in
+    that file, and test classes are started longest first. `--shard K/N` runs
+    the K-th of N shards balanced by those timings, tests without a recorded
+    time are estimated from the cost of the schema's endpoints.
+
+    Every shard must be split from the same timings, so a sharded run leaves
+    its times in `<API_TEST_TIMINGS>.partial`. Collect the shards' lines into
+    that file and fold them in with `--merge-timings` (the next run without
+    --shard folds them in as well).
+    """
+    def __init__(self, shard=None, merge_timings=False, **kwargs):
+        super(SchemaTestRunner, self).__init__(**kwargs)
+        self.shard = parse_shard(shard) if shard else None
+        self.merge_timings = merge_timings
+        self.timings_path = getattr(settings, 'API_TEST_TIMINGS', None)
+
+    @classmethod
+    def add_arguments(cls, parser):
+        super(SchemaTestRunner, cls).add_arguments(parser)
+        parser.set_defaults(parallel=default_test_processes())
+        parser.add_argument('--shard', dest='shard', default=None,
+                            help='Only run shard K of N (e.g. 2/4), balanced by the recorded test timings.')
+        parser.add_argument('--merge-timings', action='store_true', dest='merge_timings', default=False,
+                            help='Fold the times recorded by sharded runs into API_TEST_TIMINGS and run no tests.')
+
+    def schema(self):
+        schema_path = getattr(settings, 'API_SCHEMA', None)
+        return registry.get(schema_path) if schema_path is not None else None
+
+    def setup_test_environment(self, **kwargs):
+        super(SchemaTestRunner, self).setup_test_environment(**kwargs)
+        self.schema()
+
+    def build_suite(self, test_labels=None, extra_tests=None, **kwargs):
+        suite = super(SchemaTestRunner, self).build_suite(test_labels, extra_tests, **kwargs)
+        if self.shard is None and self.timings_path is None:
+            return suite
+
+        timings = Timings(self.timings_path) if self.timings_path else None
+        default = timings.default_estimate(self.schema()) if timings else 1.0
+        # A ParallelTestSuite is already split by test class
+        parallel = isinstance(suite, self.parallel_test_suite)
+        groups = suite.subsuites if parallel else partition_suite_by_case(suite)
+        weights = {}
+        for index, group in enumerate(groups):
+            test_ids = [test.id() for test in group]
+            weights[index] = timings.estimate(test_ids, default) if timings else len(test_ids)
+
+        if self.shard is not None:
+            number, count = self.shard
+            selected = lpt_shards(weights, count)[number - 1]
+        else:
+            selected = list(weights)
+        # Keep the runner's ordering by test type, longest classes first within each type
+        selected.sort(key=lambda index: (self.type_rank(groups[index]), -weights[index], index))
+        groups = [groups[index] for index in selected]
+
+        if parallel:
+            # Only self.parallel databases are cloned, the pool must not start more workers
+            self.parallel = suite.processes = min(self.parallel, len(groups))
+            if self.parallel > 1:
+                suite.subsuites = groups
+                return suite
+        ordered = self.test_suite()
+        for group in groups:
+            ordered.addTests(group)
+        return ordered
+
+    def type_rank(self, group):
+        test = next(iter(group))
+        for rank, test_type in enumerate(self.reorder_by):
+            if isinstance(test, test_type):
+                return rank
+        return len(self.reorder_by)
+
+    def run_tests(self, test_labels, extra_tests=None, **kwargs):
+        if self.merge_timings:
+            self.save_timings()
+            return 0
+        return super(SchemaTestRunner, self).run_tests(test_labels, extra_tests, **kwargs)
+
+    def run_suite(self, suite, **kwargs):
+        try:
+            return super(SchemaTestRunner, self).run_suite(suite, **kwargs)
+        finally:
+            # The other shards are split from the timings this one read, leave them as they are
+            if self.shard is None:
+                self.save_timings()
+            self.write_baseline()
+            self.write_memory_report()
+            self.write_cpu_profiles()
+            self.write_phase_report()
+
+    def save_timings(self):
+        """
+        Fold the times recorded in `<API_TEST_TIMINGS>.partial` into API_TEST_TIMINGS
+        """
+        if self.timings_path is None:
+            return
+        timings = Timings(self.timings_path)
+        timings.merge_partial(self.schema())
+        timings.save()
+
+    def write_baseline(self):
+        """
+        Record the samples assertNoRegression appended to `<API_BENCHMARK_BASELINE>.partial`
+        """
+        path = getattr(settings, 'API_BENCHMARK_BASELINE', None)
+        if path is None:
+            return
+        entries = list(read_partial(path))
+        if entries:
+            baseline = Baseline(path)
+            baseline.record_results({'endpoints': entries})
+            baseline.save()
+
+    def write_cpu_profiles(self):
+        """
+        Merge the profiles of the requests profiled with PROFILE_CPU per endpoint
+        """
+        directory = getattr(settings, 'API_PROFILE_DIR', None)
+        if directory is None:
+            return
+        summary = merge_cpu_profiles(directory)
+        if summary and self.verbosity >= 1:
+            print(u"Hottest functions per endpoint (profiles in {0}):\n{1}".format(directory, summary))
+
+    def write_phase_report(self):
+        """
+        Average the phases of the requests timed with PROFILE_PHASES
+        """
+        path = getattr(settings, 'API_PHASE_REPORT', None)
+        if path is None:
+            return
+        report = PhaseReport()
+        report.merge_partial(path)
+        if report.auth_types:
+            report.save(path)
+            if self.verbosity >= 1:
+                print(u"Time per request phase (full report in {0}):\n{1}".format(path, report.format()))
+
+    def write_memory_report(self):
+        """
+        Rank the endpoints profiled with PROFILE_MEMORY by their memory cost
+        """
+        path = getattr(settings, 'API_MEMORY_REPORT', None)
+        if path is None:
+            return
+        report = MemoryReport()
+        report.merge_partial(path)
+        if report.endpoints:
+            report.save(path)
+            if self.verbosity >= 1:
+                print(u"Memory cost per endpoint (full report in {0}):\n{1}".format(path, report.format()))
+
+
+def parse_shard(value):
+    """
+    "K/N" -> (K, N)
+    """
+    try:
+        number, count = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise ValueError(u"--shard must look like K/N, got {0!r}".format(value))
+    if not 1 <= number <= count:
+        raise ValueError(u"--shard K/N needs 1 <= K <= N, got {0!r}".format(value))
+    return number, count
@@ -0,0 +1,489 @@
+# coding=utf-8
+import os
+import re
+import copy
+import json
+import datetime
+import threading
+from decimal import Decimal
+from timeit import default_timer
+
+
+LIST_MARKERS = frozenset(['array', 'O2M', 'M2M'])
+OPTIONAL_MARKER = 'optional'
+
+# The methods an entry of the `urls` section may describe, and its `:name` placeholders
+METHODS = ('get', 'post', 'put', 'patch', 'delete')
+URL_PARAMETER_RE = re.compile(r':(\w+)')
+
+# How many elements of each list are validated: the first one, all of them,
+# or `sample:N` evenly spaced elements (always including the first and last)
+VALIDATE_FIRST = 'first'
+VALIDATE_ALL = 'all'
+VALIDATE_SAMPLE_PREFIX = 'sample:'
+
+try:
+    from itertools import imap
+    string_types = (str, unicode)
+    integer_types = (int, long)
+except ImportError:  # Python 3
+    imap = map
+    string_types = (str,)
+    integer_types = (int,)
+
+STRING_TYPES = frozenset(string_types)
+LIST_TYPES = (list, tuple)
+
+DATE_PATTERN = r'\d{4}-\d{1,2}-\d{1,2}'
+DATETIME_PATTERN = DATE_PATTERN + r'[T ]\d{1,2}:\d{1,2}(?::\d{1,2}(?:\.\d{1,12})?)?(?:Z|[+-]\d{2}(?::?\d{2})?)?'
+
+
+class TypeChecker(object):
+    """
+    The Python types a schema scalar type accepts, and an optional pattern
+    its string form must match (e.g. ISO 8601 for datetime)
+    """
+    __slots__ = ('name', 'types', 'match')
+
+    def __init__(self, name, types, pattern=None):
+        self.name = name
+        self.types = frozenset(types)
+        self.match = re.compile(u'(?:{0})\\Z'.format(pattern)).match if pattern else None
+
+
+# Dispatch table from the scalar type names used in the schema file to their checkers.
+# bool is kept out of the number types on purpose, `True` is not a valid int.
+TYPE_CHECKERS = dict((checker.name, checker) for checker in [
+    TypeChecker('string', string_types),
+    TypeChecker('int', integer_types),
+    TypeChecker('integer', integer_types),
+    TypeChecker('float', integer_types + (float, Decimal)),
+    TypeChecker('decimal', integer_types + string_types + (float, Decimal)),
+    TypeChecker('boolean', (bool,)),
+    TypeChecker('bool', (bool,)),
+    TypeChecker('datetime', string_types + (datetime.datetime,), DATETIME_PATTERN),
+    TypeChecker('date', string_types + (datetime.date,), DATE_PATTERN),
+    TypeChecker('image', string_types),
+    TypeChecker('file', string_types),
+])
+
+
+class SchemaError(AssertionError):
+    """
+    Raised when data does not match the schema. Subclasses AssertionError so
+    it is reported as a test failure rather than an error.
+    """
+    pass
+
+
+class FieldSpec(object):
+    """
+    A single `"field": "type,part,..."` entry of a schema object, parsed once
+    """
+    __slots__ = ('name', 'is_list', 'is_optional', 'ref', 'type_checker', 'parts')
+
+    def __init__(self, name, schema_type):
+        self.name = name
+        self.parts = tuple(schema_type.split(','))
+        self.is_list = False
+        self.is_optional = False
+        self.ref = None
+        self.type_checker = None
+        for part in self.parts:
+            # Parse through all parts, regardless of ordering
+            if part in LIST_MARKERS:
+                self.is_list = True
+            elif part == OPTIONAL_MARKER:
+                self.is_optional = True
+            elif part.startswith('$'):
+                self.ref = part
+            elif part in TYPE_CHECKERS:
+                self.type_checker = TYPE_CHECKERS[part]
+
+    def allowed_types(self):
+        """
+        The Python types a value of this field may have, None is allowed for optional fields
+        """
+        if self.is_optional:
+            return self.type_checker.types | frozenset([type(None)])
+        return self.type_checker.types
+
+
+class ChildValidator(object):
+    """
+    A field of an object that holds another schema object (or a list of them)
+    """
+    __slots__ = ('name', 'is_list', 'is_optional', 'ref', 'validator')
+
+    def __init__(self, spec, validator=None):
+        self.name = spec.name
+        self.is_list = spec.is_list
+        self.is_optional = spec.is_optional
+        self.ref = spec.ref
+        self.validator = validator
+
+
+class ObjectValidator(object):
+    """
+    Compiled form of a schema object: the key sets and the nested objects to
+    descend into are computed once so checking data needs no string parsing.
+    """
+    __slots__ = ('name', 'required', 'allowed', 'children', 'scalars', 'patterns', 'scalar_lists')
+
+    def __init__(self, name, schema_fields):
+        specs = [FieldSpec(field, schema_type) for field, schema_type in schema_fields.items()]
+        self.name = name
+        self.required = frozenset(spec.name for spec in specs if not spec.is_optional)
+        self.allowed = frozenset(spec.name for spec in specs)
+        self.children = tuple(ChildValidator(spec) for spec in specs if spec.ref)
+
+        # (field, allowed types, type name) of every scalar field and (field, match, type name)
+        # of those whose strings must also match a pattern
+        scalars = [spec for spec in specs if spec.type_checker and not spec.ref and not spec.is_list]
+        self.scalars = tuple((spec.name, spec.allowed_types(), spec.type_checker.name) for spec in scalars)
+        self.patterns = tuple((spec.name, spec.type_checker.match, spec.type_checker.name) for spec in scalars
+                              if spec.type_checker.match)
+        self.scalar_lists = tuple((spec.name, spec.type_checker) for spec in specs
+                                  if spec.type_checker and not spec.ref and spec.is_list)
+
+    def link(self, validators):
+        """
+        Resolve `$object` references once every object has been compiled
+        """
+        for child in self.children:
+            child.validator = validators.get(child.ref)
+
+    def key_error(self, keys):
+        # The actual `data_object` contains every required field
+        if not self.required.issubset(keys):
+            raise SchemaError("Data did not match schema.\nMissing fields: {}".format(
+                set(self.required.difference(keys))))
+        # The actual `data_object` contains no extraneous fields not found in the schema
+        raise SchemaError("Data did not match schema.\nExtra fields: {}".format(keys.difference(self.allowed)))
+
+    def check_keys(self, data_object):
+        """
+        Check the keys of `data_object` only, nested objects are left to `validate_data`
+        """
+        keys = set(data_object)
+        if not self.required <= keys <= self.allowed:
+            self.key_error(keys)
+
+    def check_object(self, data_object, kind=VALIDATE_FIRST, size=None):
+        """
+        Check the keys of `data_object` and the values of its scalar fields
+        against their declared types in one pass, nested objects are left to `validate_data`
+        """
+        keys = set(data_object)
+        if not self.required <= keys <= self.allowed:
+            self.key_error(keys)
+        get = data_object.get
+        for name, types, type_name in self.scalars:
+            if type(get(name)) not in types:
+                check_value(name, types, type_name, get(name))
+        for name, match, type_name in self.patterns:
+            value = get(name)
+            if type(value) in STRING_TYPES and match(value) is None:
+                raise pattern_error(name, type_name, value)
+        for name, checker in self.scalar_lists:
+            values = get(name)
+            if values is None:
+                continue
+            if not isinstance(values, LIST_TYPES):
+                raise list_error(name, values)
+            if kind != VALIDATE_ALL:
+                values = [values[index] for index in select_indexes(len(values), kind, size)]
+            if not checker.types.issuperset(imap(type, values)):
+                for value in values:
+                    check_value(name, checker.types, checker.name, value)
+            if checker.match is not None:
+                for value in values:
+                    if type(value) in STRING_TYPES and checker.match(value) is None:
+                        raise pattern_error(name, checker.name, value)
+
+    def check(self, data_object, mode=VALIDATE_FIRST, check_types=False):
+        """
+        `data_object` is the actual JSON being sent or received
+        """
+        return validate_data(self, data_object, mode, check_types=check_types)
+
+
+def check_value(name, types, type_name, value):
+    """
+    Slow path for a value whose type is not one of `types`: subclasses pass,
+    except bool, which subclasses int
+    """
+    if isinstance(value, bool) and bool not in types or not isinstance(value, tuple(types)):
+        raise SchemaError("Data did not match schema.\nField {0} is not of type {1}: {2!r}".format(
+            name, type_name, value))
+
+
+def list_error(name, value):
+    return SchemaError("Data did not match schema.\nField {0} is not a list: {1!r}".format(name, value))
+
+
+def pattern_error(name, type_name, value):
+    return SchemaError("Data did not match schema.\nField {0} is not a valid {1}: {2!r}".format(
+        name, type_name, value))
+
+
+def parse_validate_mode(mode):
+    """
+    Split a `validate` argument into its kind and sample size
+    """
+    if mode in (VALIDATE_FIRST, VALIDATE_ALL):
+        return mode, None
+    if mode and mode.startswith(VALIDATE_SAMPLE_PREFIX):
+        try:
+            size = int(mode[len(VALIDATE_SAMPLE_PREFIX):])
+        except ValueError:
+            size = None
+        if size is not None:
+            if size < 1:
+                raise ValueError(u"sample size must be a positive integer, got {0}".format(mode))
+            return VALIDATE_SAMPLE_PREFIX, size
+    raise ValueError(u"validate must be one of 'first', 'all' or 'sample:N', got {0!r}".format(mode))
+
+
+def select_indexes(length, kind, size):
+    """
+    Return the indexes of a list of `length` elements to validate
+    """
+    if length == 0:
+        return ()
+    if kind == VALIDATE_FIRST:
+        return (0,)
+    if kind == VALIDATE_ALL or length <= size:
+        return range(length)
+    if size == 1:
+        return (0,)
+    step = float(length - 1) / (size - 1)
+    return sorted(set(int(round(i * step)) for i in range(size)))
+
+
+def format_path(path):
+    """
+    Turn the linked `(parent, key)` path built while validating into `results[3].user`
+    """
+    parts = []
+    while path is not None:
+        path, key = path
+        parts.append('[{0}]'.format(key) if isinstance(key, int) else '.{0}'.format(key))
+    return ''.join(reversed(parts)).lstrip('.')
+
+
+class ValidationReport(object):
+    """
+    What a validation pass covered and how fast it went
+    """
+    __slots__ = ('object_name', 'mode', 'many', 'total', 'checked', 'objects', 'elapsed', 'failed_index')
+
+    def __init__(self, object_name, mode):
+        self.object_name = object_name
+        self.mode = mode
+        # Whether the data was a collection (list or paginated `results`)
+        self.many = False
+        self.total = 1
+        self.checked = 0
+        self.objects = 0
+        self.elapsed = 0.0
+        self.failed_index = None
+
+    @property
+    def rate(self):
+        """
+        Elements validated per second
+        """
+        return self.checked / self.elapsed if self.elapsed else float('inf')
+
+    def __repr__(self):
+        return '<ValidationReport {0} mode={1} checked={2}/{3} objects={4} rate={5:.0f}/s>'.format(
+            self.object_name, self.mode, self.checked, self.total, self.objects, self.rate)
+
+
+def walk(validator, elements, kind, size, report, check_types=False):
+    """
+    Check the keys of every selected object reachable from `elements`, an
+    iterable of `(index, data_object)` pairs (index is None for a single object).
+    Nested objects are walked with an explicit stack rather than recursion, so
+    the cost is linear in the number of objects checked.
+    With `check_types` each object's scalar values are checked in the same pass.
+    """
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    path = index = None
+    try:
+        for index, data_object in elements:
+            push((validator, data_object, None if index is None else (None, index)))
+            while stack:
+                current, data_object, path = pop()
+                if not isinstance(data_object, dict):
+                    raise SchemaError("Data did not match schema.\nExpected an object, got {0!r}".format(data_object))
+                if check_types:
+                    current.check_object(data_object, kind, size)
+                else:
+                    current.check_keys(data_object)
+                report.objects += 1
+                for child in current.children:
+                    # If this field is actually another related object, then check that object's fields as well
+                    value = data_object.get(child.name)
+                    if value is None:
+                        # If our new object to check is None and optional then continue, else raise an error
+                        if child.is_optional:
+                            continue
+                        raise SchemaError("No data for object {0}".format(child.ref))
+                    if child.validator is None:
+                        raise SchemaError("Schema object {0} is not defined".format(child.ref))
+                    if child.is_list:
+                        if not isinstance(value, LIST_TYPES):
+                            raise list_error(child.name, value)
+                        child_path = (path, child.name)
+                        for child_index in select_indexes(len(value), kind, size):
+                            push((child.validator, value[child_index], (child_path, child_index)))
+                    else:
+                        push((child.validator, value, (path, child.name)))
+            report.checked += 1
+            path = None
+    except SchemaError as error:
+        report.failed_index = index
+        location = format_path(path)
+        message = error.args[0]
+        if location:
+            message = u"{0} (at {1})".format(message, location)
+        failure = SchemaError(message)
+        failure.report = report
+        raise failure
+
+
+def validate_data(validator, data, mode=VALIDATE_FIRST, many=False, check_types=False):
+    """
+    Validate `data` (a list of elements if `many`) against a compiled validator.
+    Raises SchemaError naming the index and path of the first bad element.
+    With `check_types` the values of scalar fields are checked as well as the keys.
+    """
+    kind, size = parse_validate_mode(mode)
+    report = ValidationReport(validator.name, mode)
+    report.many = many
+    if many:
+        report.total = len(data)
+        roots = select_indexes(report.total, kind, size)
+    else:
+        roots = (None,)
+
+    def elements():
+        for index in roots:
+            yield index, data if index is None else data[index]
+
+    start = default_timer()
+    try:
+        walk(validator, elements(), kind, size, report, check_types=check_types)
+    finally:
+        report.elapsed = default_timer() - start
+    return report
+
+
+def compile_objects(schema_objects):
+    """
+    Compile every `$object` of a schema into a linked ObjectValidator
+    """
+    validators = dict((name, ObjectValidator(name, fields)) for name, fields in schema_objects.items())
+    for validator in validators.values():
+        validator.link(validators)
+    return validators
+
+
+class ReadOnlyDict(dict):
+    """
+    A dict that refuses to be modified after it has been built.
+    Every test case shares the same schema objects, so one test must not be
+    able to change what the next one validates against.
+    """
+    def _readonly(self, *args, **kwargs):
+        raise TypeError(u"schema objects are read-only")
+
+    __setitem__ = _readonly
+    __delitem__ = _readonly
+    clear = _readonly
+    pop = _readonly
+    popitem = _readonly
+    setdefault = _readonly
+    update = _readonly
+
+    # Copies are plain dicts a test may change, pickling keeps the object read-only
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return dict((copy.deepcopy(key, memo), copy.deepcopy(item, memo)) for key, item in self.items())
+
+    def __reduce__(self):
+        return ReadOnlyDict, (dict(self),)
+
+
+def freeze(value):
+    """
+    Recursively turn dicts into ReadOnlyDict and lists into tuples
+    """
+    if isinstance(value, dict):
+        return ReadOnlyDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class CompiledSchema(object):
+    """
+    The parsed content of an API_SCHEMA file
+    """
+    def __init__(self, path, mtime, schema_data):
+        self.path = path
+        self.mtime = mtime
+        self.urls = freeze(schema_data.get('urls', []))
+        self.objects = freeze(schema_data['objects'])
+        self.validators = compile_objects(self.objects)
+        self._validators_by_id = dict((id(self.objects[name]), validator)
+                                      for name, validator in self.validators.items())
+
+    def validator_for(self, schema_fields):
+        """
+        Return the compiled validator for a fields mapping, compiling ad hoc
+        mappings that did not come from this schema file
+        """
+        validator = self._validators_by_id.get(id(schema_fields))
+        if validator is None:
+            validator = ObjectValidator(None, schema_fields)
+            validator.link(self.validators)
+        return validator
+
+
+class SchemaRegistry(object):
+    """
+    Process-wide cache of schema files, keyed by absolute path and mtime.
+    The file is only read again when it changes on disk.
+    """
+    def __init__(self):
+        self._schemas = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        path = os.path.abspath(path)
+        mtime = os.path.getmtime(path)
+        schema = self._schemas.get(path)
+        if schema is not None and schema.mtime == mtime:
+            return schema
+
+        with self._lock:
+            schema = self._schemas.get(path)
+            if schema is None or schema.mtime != mtime:
+                with open(path) as file:
+                    schema = CompiledSchema(path, mtime, json.loads(file.read()))
+                self._schemas[path] = schema
+        return schema
+
+    def clear(self):
+        with self._lock:
+            self._schemas.clear()
+
+
+registry = SchemaRegistry()
@@ -0,0 +1,146 @@
+# coding=utf-8
+"""
+Test timings and duration-aware sharding
+
+Every SchemaTestCase test appends its wall time and the requests it made to
+`<API_TEST_TIMINGS>.partial` (one JSON line per test, so parallel workers can
+share it). SchemaTestRunner folds these lines into the API_TEST_TIMINGS file
+after the run and uses the file to split test classes into shards.
+"""
+import os
+import re
+import json
+import threading
+from schema import METHODS, URL_PARAMETER_RE
+
+
+_partial_lock = threading.Lock()
+
+
+def partial_path(path):
+    return path + '.partial'
+
+
+def append_partial(path, entry):
+    """
+    Append one JSON line to the `.partial` file next to `path`
+    """
+    line = json.dumps(entry)
+    with _partial_lock:
+        with open(partial_path(path), 'a') as file:
+            file.write(line + '\n')
+
+
+def read_partial(path):
+    """
+    Yield the entries of the `.partial` file next to `path` and remove it
+    """
+    path = partial_path(path)
+    if not os.path.exists(path):
+        return
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+    os.remove(path)
+
+
+def record_test(path, test_id, seconds, requests):
+    """
+    Append the timing of one test, `requests` is a list of (method, path, seconds)
+    """
+    append_partial(path, {'test': test_id, 'seconds': seconds, 'requests': requests})
+
+
+def url_pattern(url, prefix='/'):
+    """
+    A regex matching the request paths of a schema url, `:name` matches one path segment
+    """
+    parts = URL_PARAMETER_RE.split(url)
+    # split() alternates literal text and placeholder names
+    pattern = ''.join(re.escape(part) if index % 2 == 0 else '[^/]+' for index, part in enumerate(parts))
+    return re.compile('^' + re.escape(prefix) + pattern + '$')
+
+
+class Timings(object):
+    """
+    Recorded seconds per test id and per schema endpoint ("GET users/")
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tests = {}
+        # endpoint -> [total seconds, request count]
+        self.endpoints = {}
+        # [total requests, test count]
+        self.requests_per_test = [0, 0]
+        if os.path.exists(path):
+            with open(path) as file:
+                data = json.load(file)
+            self.tests = data.get('tests', {})
+            self.endpoints = data.get('endpoints', {})
+            self.requests_per_test = data.get('requests_per_test', [0, 0])
+
+    def merge_partial(self, schema=None):
+        """
+        Fold the lines recorded since the last run into the timings and remove them
+        """
+        patterns = []
+        if schema is not None:
+            patterns = [(url_pattern(entry['url']), entry['url']) for entry in schema.urls]
+        for entry in read_partial(self.path):
+            self.tests[entry['test']] = entry['seconds']
+            self.requests_per_test[0] += len(entry['requests'])
+            self.requests_per_test[1] += 1
+            for method, request_path, seconds in entry['requests']:
+                for pattern, url in patterns:
+                    if pattern.match(request_path):
+                        totals = self.endpoints.setdefault(u'{0} {1}'.format(method.upper(), url), [0.0, 0])
+                        totals[0] += seconds
+                        totals[1] += 1
+                        break
+
+    def save(self):
+        with open(self.path, 'w') as file:
+            json.dump({'tests': self.tests, 'endpoints': self.endpoints,
+                       'requests_per_test': self.requests_per_test}, file, indent=2, sort_keys=True)
+
+    def default_estimate(self, schema=None):
+        """
+        Estimated seconds of a test nothing is known about: the average number of
+        requests per test times the average cost of the schema's endpoints
+        """
+        costs = [total / count for total, count in self.endpoints.values() if count]
+        if schema is not None:
+            keys = set(u'{0} {1}'.format(method.upper(), entry['url'])
+                       for entry in schema.urls for method in METHODS if method in entry)
+            known = [total / count for key, (total, count) in self.endpoints.items() if count and key in keys]
+            costs = known or costs
+        total_requests, tests = self.requests_per_test
+        if costs and tests:
+            return max(1.0, float(total_requests) / tests) * sum(costs) / len(costs)
+        if self.tests:
+            return sum(self.tests.values()) / len(self.tests)
+        return 1.0
+
+    def estimate(self, test_ids, default):
+        """
+        Seconds for a group of tests: recorded times, the mean of the group's
+        known tests for the others, `default` when none is known
+        """
+        known = [self.tests[test_id] for test_id in test_ids if test_id in self.tests]
+        fallback = sum(known) / len(known) if known else default
+        return sum(known) + fallback * (len(test_ids) - len(known))
+
+
+def lpt_shards(weights, count):
+    """
+    Longest-processing-time-first bin packing: hand the heaviest remaining item
+    to the lightest shard. `weights` maps item -> seconds, returns `count` lists.
+    """
+    shards = [[] for _ in range(count)]
+    loads = [0.0] * count
+    for item, weight in sorted(weights.items(), key=lambda item: (-item[1], item[0])):
+        lightest = loads.index(min(loads))
+        shards[lightest].append(item)
+        loads[lightest] += weight
+    return shards
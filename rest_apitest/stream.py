@@ -0,0 +1,347 @@
+# coding=utf-8
+"""
+Validate rendered JSON (`response.content` or `response.streaming_content`)
+against the compiled schema without loading the whole document.
+
+The pipeline is made of generators: byte chunks -> parse events -> top level
+elements -> `schema.walk`. Only the element being checked is held in memory
+at any time, `sample:N` spools the body (to disk past SPOOL_SIZE) to count
+the elements before picking them.
+"""
+import re
+import codecs
+import tempfile
+from json.decoder import scanstring
+from timeit import default_timer
+from schema import (SchemaError, ValidationReport, parse_validate_mode, select_indexes, walk,
+                    VALIDATE_FIRST, VALIDATE_ALL, VALIDATE_SAMPLE_PREFIX)
+
+
+START_MAP = 'start_map'
+END_MAP = 'end_map'
+MAP_KEY = 'map_key'
+START_ARRAY = 'start_array'
+END_ARRAY = 'end_array'
+VALUE = 'value'
+
+WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+NUMBER_RE = re.compile(r'-?(?:0|[1-9]\d*)(\.\d+)?([eE][-+]?\d+)?')
+NUMBER_CHARS = u'0123456789.eE+-'
+LITERALS = ((u'true', True), (u'false', False), (u'null', None))
+
+# The read size used when `response.content` is already in memory
+CHUNK_SIZE = 64 * 1024
+# How much of a body sampled with `sample:N` is spooled in memory before moving to disk
+SPOOL_SIZE = 1024 * 1024
+
+
+def iter_chunks(response, chunk_size=CHUNK_SIZE):
+    """
+    Yield the body of a response as byte chunks
+    """
+    if getattr(response, 'streaming', False):
+        for chunk in response.streaming_content:
+            yield chunk
+    else:
+        content = response.content
+        for start in range(0, len(content), chunk_size):
+            yield content[start:start + chunk_size]
+
+
+class EventReader(object):
+    """
+    Incrementally tokenize a JSON document into `(event, value)` pairs, in the
+    style of ijson's basic_parse. Raises SchemaError on malformed JSON.
+    """
+    def __init__(self, chunks, encoding='utf-8'):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.buf = u''
+        self.pos = 0
+        self.done = False
+
+    def fill(self):
+        """
+        Drop the consumed part of the buffer and append the next chunk.
+        Returns False once the input is exhausted.
+        """
+        if self.done:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.done = True
+            text = self.decoder.decode(b'', True)
+        else:
+            text = self.decoder.decode(chunk)
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def skip_whitespace(self):
+        """
+        Move to the next significant character, returns it or None at the end of input
+        """
+        while True:
+            self.pos = WHITESPACE_RE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return None
+
+    def error(self, message):
+        return SchemaError(u"Response is not valid JSON: {0}".format(message))
+
+    def read_string(self):
+        while True:
+            try:
+                value, self.pos = scanstring(self.buf, self.pos + 1)
+                return value
+            except ValueError:
+                # The string may continue in the next chunk
+                if not self.fill():
+                    raise self.error(u"unterminated string")
+
+    def read_scalar(self):
+        while True:
+            match = NUMBER_RE.match(self.buf, self.pos)
+            if match and match.end() > self.pos:
+                end = match.end()
+                if (end == len(self.buf) or self.buf[end] in NUMBER_CHARS) and self.fill():
+                    # The number may continue in the next chunk
+                    continue
+                self.pos = match.end()
+                return float(match.group()) if match.group(1) or match.group(2) else int(match.group())
+            for word, value in LITERALS:
+                if self.buf.startswith(word, self.pos):
+                    self.pos += len(word)
+                    return value
+            if len(self.buf) - self.pos < 5 and self.fill():
+                # A literal split across chunks
+                continue
+            raise self.error(u"unexpected {0!r}".format(self.buf[self.pos:self.pos + 20]))
+
+    def __iter__(self):
+        # Each entry is the container being filled: START_MAP or START_ARRAY
+        containers = []
+        expect_key = False
+        expect_value = True
+        # Set after ',' or ':' when a closing bracket is not allowed
+        pending = False
+
+        while True:
+            char = self.skip_whitespace()
+            if char is None:
+                break
+            if not containers and not expect_value:
+                raise self.error(u"extra data {0!r}".format(self.buf[self.pos:self.pos + 20]))
+
+            if expect_key and char == u'"':
+                key = self.read_string()
+                if self.skip_whitespace() != u':':
+                    raise self.error(u"expected ':' after key {0!r}".format(key))
+                self.pos += 1
+                yield MAP_KEY, key
+                expect_key = False
+                expect_value = pending = True
+            elif char in u'}]':
+                container = START_MAP if char == u'}' else START_ARRAY
+                if pending or not containers or containers[-1] != container:
+                    raise self.error(u"unexpected {0!r}".format(char))
+                containers.pop()
+                self.pos += 1
+                yield (END_MAP if char == u'}' else END_ARRAY), None
+                expect_key = expect_value = False
+            elif char == u',':
+                if expect_value or expect_key or not containers:
+                    raise self.error(u"unexpected ','")
+                self.pos += 1
+                pending = True
+                if containers[-1] == START_MAP:
+                    expect_key = True
+                else:
+                    expect_value = True
+            elif not expect_value:
+                raise self.error(u"unexpected {0!r}".format(self.buf[self.pos:self.pos + 20]))
+            elif char in u'{[':
+                self.pos += 1
+                pending = False
+                if char == u'{':
+                    containers.append(START_MAP)
+                    yield START_MAP, None
+                    expect_key = True
+                    expect_value = False
+                else:
+                    containers.append(START_ARRAY)
+                    yield START_ARRAY, None
+            else:
+                value = self.read_string() if char == u'"' else self.read_scalar()
+                yield VALUE, value
+                expect_value = pending = False
+
+        if containers or expect_value:
+            raise self.error(u"unexpected end of data")
+
+
+def iter_events(chunks, encoding='utf-8'):
+    """
+    Generator of `(event, value)` parse events for a JSON body given as byte chunks
+    """
+    return iter(EventReader(chunks, encoding))
+
+
+def build(events, event, value):
+    """
+    Build the Python value starting with `(event, value)`, consuming its events
+    """
+    if event == VALUE:
+        return value
+    root = {} if event == START_MAP else []
+    stack = [root]
+    key = None
+    for event, value in events:
+        container = stack[-1]
+        if event == MAP_KEY:
+            key = value
+            continue
+        if event in (END_MAP, END_ARRAY):
+            stack.pop()
+            if not stack:
+                return root
+            continue
+        if event == VALUE:
+            item = value
+        else:
+            item = {} if event == START_MAP else []
+        if isinstance(container, dict):
+            container[key] = item
+        else:
+            container.append(item)
+        if event != VALUE:
+            stack.append(item)
+    raise SchemaError(u"Response is not valid JSON: unexpected end of data")
+
+
+def skip(events, event):
+    """
+    Consume the events of a value without building it
+    """
+    if event == VALUE:
+        return
+    depth = 1
+    for event, _ in events:
+        if event in (START_MAP, START_ARRAY):
+            depth += 1
+        elif event in (END_MAP, END_ARRAY):
+            depth -= 1
+            if depth == 0:
+                return
+
+
+def iter_array(events, kind, size, report, indexes=None):
+    """
+    Yield the selected `(index, element)` pairs of the array whose START_ARRAY
+    was just consumed. For `sample:N` the length is not known up front, so the
+    indexes to check are given in `indexes` (see validate_stream).
+    """
+    index = 0
+    for event, value in events:
+        if event == END_ARRAY:
+            break
+        report.total = index + 1
+        if kind == VALIDATE_ALL or (index == 0 if kind == VALIDATE_FIRST else index in indexes):
+            yield index, build(events, event, value)
+        else:
+            skip(events, event)
+        index += 1
+    report.total = index
+
+
+def iter_elements(events, kind, size, report, indexes=None):
+    """
+    Yield what `check_response_data` would validate: the elements of a list,
+    of the `results` list of a paginated response, or the single object
+    """
+    event, value = next(events, (None, None))
+    if event is None:
+        raise SchemaError(u"Response is not valid JSON: no content")
+    if event == START_ARRAY:
+        report.many = True
+        for item in iter_array(events, kind, size, report, indexes):
+            yield item
+    elif event == START_MAP:
+        root = {}
+        for event, key in events:
+            if event == END_MAP:
+                break
+            event, value = next(events)
+            if key == 'results' and event == START_ARRAY:
+                report.many = True
+                for item in iter_array(events, kind, size, report, indexes):
+                    yield item
+            else:
+                root[key] = build(events, event, value)
+        if not report.many:
+            yield None, root
+    else:
+        yield None, value
+    # Drain the tokenizer so trailing garbage is reported
+    for _ in events:
+        pass
+
+
+def spool(chunks):
+    """
+    Copy byte chunks to a SpooledTemporaryFile, which moves to disk past SPOOL_SIZE
+    """
+    spooled = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+    for chunk in chunks:
+        spooled.write(chunk)
+    return spooled
+
+
+def iter_spooled(spooled, chunk_size=CHUNK_SIZE):
+    spooled.seek(0)
+    while True:
+        chunk = spooled.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def count_elements(chunks):
+    """
+    Length of the list (or paginated `results`) of a JSON body, None for a single object
+    """
+    report = ValidationReport(None, VALIDATE_FIRST)
+    for _ in iter_elements(iter_events(chunks), VALIDATE_FIRST, None, report):
+        pass
+    return report.total if report.many else None
+
+
+def validate_stream(validator, chunks, mode=VALIDATE_FIRST, check_types=False):
+    """
+    Validate a rendered JSON body, given as an iterable of byte chunks,
+    against a compiled validator. For `sample:N` the body is spooled and read
+    twice, once to count the elements, so the same evenly spaced elements are
+    checked as by `validate_data`.
+    """
+    kind, size = parse_validate_mode(mode)
+    report = ValidationReport(validator.name, mode)
+    start = default_timer()
+    indexes = spooled = None
+    try:
+        if kind == VALIDATE_SAMPLE_PREFIX:
+            spooled = spool(chunks)
+            length = count_elements(iter_spooled(spooled))
+            if length is not None:
+                indexes = frozenset(select_indexes(length, kind, size))
+            chunks = iter_spooled(spooled)
+        elements = iter_elements(iter_events(chunks), kind, size, report, indexes)
+        walk(validator, elements, kind, size, report, check_types=check_types)
+        if report.many and report.total == 0:
+            raise SchemaError("No data to compare response")
+    finally:
+        if spooled is not None:
+            spooled.close()
+        report.elapsed = default_timer() - start
+    return report
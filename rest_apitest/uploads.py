@@ -0,0 +1,212 @@
+# coding=utf-8
+"""
+Memory-bounded uploads: generated large files, a streaming multipart body
+and chunked comparison of the stored file with its source
+"""
+import os
+import uuid
+import random
+import struct
+import mimetypes
+from django.utils.encoding import force_bytes
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+CHUNK_SIZE = 1024 * 1024
+BLOCK_SIZE = 64 * 1024
+
+# Default Django upload handler -> the recording subclass below
+RECORDING_HANDLERS = {
+    'django.core.files.uploadhandler.MemoryFileUploadHandler': 'rest_apitest.uploads.RecordingMemoryUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler':
+        'rest_apitest.uploads.RecordingTemporaryUploadHandler',
+}
+
+# (field name, size, True when written to a temporary file) of each received upload
+received_uploads = []
+
+
+class LargeFile(object):
+    """
+    A read-only file of `size` bytes generated on the fly, e.g. LargeFile(1024 ** 3)
+    for a 1 GB upload without a 1 GB buffer. The content is a random block
+    repeated with its index stamped at the start, so two LargeFiles with the
+    same size and seed are equal and shifted or swapped blocks are not.
+    """
+    def __init__(self, size, name='upload.bin', seed=0):
+        self.size = size
+        self.name = name
+        self.position = 0
+        sampler = random.Random(seed)
+        self.block = bytearray(sampler.getrandbits(8) for _ in range(BLOCK_SIZE))
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        size = min(size, self.size - self.position)
+        chunk = bytearray()
+        while len(chunk) < size:
+            index, offset = divmod(self.position + len(chunk), BLOCK_SIZE)
+            block = self.block[:]
+            block[:8] = struct.pack('>Q', index)
+            chunk += block[offset:offset + size - len(chunk)]
+        self.position += size
+        return bytes(chunk)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.size
+        self.position = max(0, min(offset, self.size))
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def file_size(fileobj):
+    """
+    Size of a seekable file object, its position is left unchanged
+    """
+    position = fileobj.tell()
+    size = fileobj.seek(0, 2)
+    if size is None:  # Python 2 files return None
+        size = fileobj.tell()
+    fileobj.seek(position)
+    return size
+
+
+def iter_file(fileobj, chunk_size=CHUNK_SIZE):
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def files_equal(first, second, chunk_size=CHUNK_SIZE):
+    """
+    Compare two file objects chunk by chunk, holding at most one chunk of each
+    """
+    first.seek(0)
+    second.seek(0)
+    while True:
+        a = first.read(chunk_size)
+        b = second.read(chunk_size)
+        # read() may return short chunks before the end
+        while len(a) != len(b):
+            more = (second if len(a) > len(b) else first).read(abs(len(a) - len(b)))
+            if not more:
+                return False
+            if len(a) > len(b):
+                b += more
+            else:
+                a += more
+        if a != b:
+            return False
+        if not a:
+            return True
+
+
+class MultipartStream(object):
+    """
+    A multipart/form-data body read in chunks. Files are read from their file
+    objects as the body is consumed, so the whole upload is never in memory.
+    `fields` maps names to strings, `files` maps names to seekable file objects.
+    """
+    def __init__(self, fields=None, files=None, boundary=None, chunk_size=CHUNK_SIZE):
+        self.boundary = boundary or uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self.parts = []
+        for name, value in sorted((fields or {}).items()):
+            self.parts.append(force_bytes(
+                '--{0}\r\nContent-Disposition: form-data; name="{1}"\r\n\r\n{2}\r\n'.format(
+                    self.boundary, name, value)))
+        for name, fileobj in sorted((files or {}).items()):
+            filename = os.path.basename(getattr(fileobj, 'name', name))
+            content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            self.parts.append(force_bytes(
+                '--{0}\r\nContent-Disposition: form-data; name="{1}"; filename="{2}"\r\n'
+                'Content-Type: {3}\r\n\r\n'.format(self.boundary, name, filename, content_type)))
+            self.parts.append(fileobj)
+            self.parts.append(b'\r\n')
+        self.parts.append(force_bytes('--{0}--\r\n'.format(self.boundary)))
+        self.length = sum(len(part) if isinstance(part, bytes) else file_size(part) for part in self.parts)
+        self._chunks = self._iter_chunks()
+        self._buffer = b''
+        self._offset = 0
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary={0}'.format(self.boundary)
+
+    def _iter_chunks(self):
+        for part in self.parts:
+            if isinstance(part, bytes):
+                yield part
+            else:
+                part.seek(0)
+                for chunk in iter_file(part, self.chunk_size):
+                    yield chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self._buffer[self._offset:] + b''.join(self._chunks)
+            self._buffer, self._offset = b'', 0
+            return data
+        pieces = []
+        while size > 0:
+            if self._offset >= len(self._buffer):
+                self._buffer, self._offset = next(self._chunks, b''), 0
+                if not self._buffer:
+                    break
+            piece = self._buffer[self._offset:self._offset + size]
+            self._offset += len(piece)
+            size -= len(piece)
+            pieces.append(piece)
+        return b''.join(pieces)
+
+    def readline(self, size=-1):
+        # Only used for the headers of a multipart body, which are short
+        line = b''
+        while size < 0 or len(line) < size:
+            char = self.read(1)
+            line += char
+            if not char or char == b'\n':
+                break
+        return line
+
+    def environ(self):
+        """
+        The WSGI environ entries that send this body with the test client
+        """
+        return {
+            'CONTENT_LENGTH': str(self.length),
+            'CONTENT_TYPE': self.content_type,
+            'wsgi.input': self,
+        }
+
+
+class RecordingMemoryUploadHandler(MemoryFileUploadHandler):
+    def file_complete(self, file_size):
+        uploaded = super(RecordingMemoryUploadHandler, self).file_complete(file_size)
+        if uploaded is not None:
+            received_uploads.append((self.field_name, file_size, False))
+        return uploaded
+
+
+class RecordingTemporaryUploadHandler(TemporaryFileUploadHandler):
+    def file_complete(self, file_size):
+        uploaded = super(RecordingTemporaryUploadHandler, self).file_complete(file_size)
+        if uploaded is not None:
+            received_uploads.append((self.field_name, file_size, True))
+        return uploaded
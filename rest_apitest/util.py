@@ -2,12 +2,15 @@
 import sys
 import factory
 import datetime
-import oauth2_provider
 from base64 import b64encode
+from importlib import import_module
+from django.conf import settings
 from django.utils.timezone import now
+from oauthlib.common import generate_token
 from rest_framework.test import APITestCase
-from oauth2_provider.models import AccessToken
+from oauth2_provider.models import AccessToken, get_application_model
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import get_hasher, make_password
 
 
 User = get_user_model()
@@ -43,15 +46,162 @@ def to_native_string(string, encoding='ascii'):
     return out
 
 
+# (username, password) -> Basic Auth string
+_basic_auth_strs = {}
+
+
 def basic_auth_str(username, password):
     """Returns a Basic Auth string."""
-
-    authstr = 'Basic ' + to_native_string(
-        b64encode(('%s:%s' % (username, password)).encode('latin1')).strip()
-    )
+    authstr = _basic_auth_strs.get((username, password))
+    if authstr is None:
+        authstr = _basic_auth_strs[(username, password)] = 'Basic ' + to_native_string(
+            b64encode(('%s:%s' % (username, password)).encode('latin1')).strip()
+        )
     return authstr
 
 
+# (raw password, hasher algorithm) -> encoded password
+_password_hashes = {}
+
+
+def cached_make_password(raw_password):
+    """
+    Hash each distinct raw password once per process.
+    Users created with the same password share the encoded hash (salt included),
+    which is harmless in tests and saves a full PBKDF2 run per user.
+    """
+    key = (raw_password, get_hasher().algorithm)
+    encoded = _password_hashes.get(key)
+    if encoded is None:
+        encoded = _password_hashes[key] = make_password(raw_password)
+    return encoded
+
+
+# Values per `__in` lookup, SQLite allows 999 variables per statement.
+# bulk_create is left to pick its own batch size, which accounts for the number of columns.
+BULK_BATCH_SIZE = 500
+
+
+def bulk_create_users(users):
+    """
+    Write unsaved users with `bulk_create` and make sure each has its pk,
+    which only PostgreSQL returns from a bulk insert.
+    post_save is not sent for these users.
+    """
+    model = type(users[0])
+    model.objects.bulk_create(users)
+    missing = [user for user in users if user.pk is None]
+    field = model.USERNAME_FIELD
+    for start in range(0, len(missing), BULK_BATCH_SIZE):
+        chunk = missing[start:start + BULK_BATCH_SIZE]
+        pks = dict(model.objects.filter(**{field + '__in': [getattr(user, field) for user in chunk]})
+                   .values_list(field, 'pk'))
+        for user in chunk:
+            user.pk = pks[getattr(user, field)]
+    return users
+
+
+def session_exists(session_key):
+    """
+    Whether a session key still refers to a stored session
+    """
+    if not session_key:
+        return False
+    return bool(import_module(settings.SESSION_ENGINE).SessionStore(session_key).load())
+
+
+class TokenPool(object):
+    """
+    Mints AccessTokens for many users with one query for their Applications
+    and one bulk INSERT, and remembers each user's token on the instance
+    (`user.cached_access_token`) so the Bearer header needs no query.
+
+    Tokens minted between `begin()` and `end()` are forgotten by `end()`:
+    SchemaTestCase wraps each test in them, because the test's rollback
+    deletes the AccessToken rows while the user objects may live on as class fixtures.
+    """
+    def __init__(self, expires=datetime.timedelta(days=1)):
+        self.expires = expires
+        # One list of users per open begin()
+        self._scopes = []
+
+    def begin(self):
+        self._scopes.append([])
+
+    def end(self):
+        for user in self._scopes.pop():
+            user.__dict__.pop('cached_access_token', None)
+
+    def remember(self, user, token):
+        user.cached_access_token = token
+        if self._scopes:
+            self._scopes[-1].append(user)
+
+    def applications(self, users):
+        """
+        user pk -> pk of the user's first Application
+        """
+        Application = get_application_model()
+        user_ids = [user.pk for user in users]
+        applications = {}
+        for start in range(0, len(user_ids), BULK_BATCH_SIZE):
+            rows = (Application.objects.filter(user_id__in=user_ids[start:start + BULK_BATCH_SIZE])
+                    .order_by('-pk').values_list('user_id', 'pk'))
+            applications.update(rows)
+        return applications
+
+    def create_applications(self, users):
+        """
+        Bulk create a client credentials Application for each user
+        """
+        Application = get_application_model()
+        Application.objects.bulk_create([
+            Application(user=user,
+                        name='app{}'.format(user.pk),
+                        client_type=Application.CLIENT_CONFIDENTIAL,
+                        authorization_grant_type=Application.GRANT_CLIENT_CREDENTIALS)
+            for user in users])
+
+    def mint(self, users, applications=None):
+        """
+        Create a random AccessToken for every user, `applications` maps user pk
+        to Application pk and is looked up when not given. Users without an
+        Application get one.
+        """
+        if applications is None:
+            applications = self.applications(users)
+        missing = [user for user in users if user.pk not in applications]
+        if missing:
+            self.create_applications(missing)
+            applications = dict(applications, **self.applications(missing))
+        expires = now() + self.expires
+        tokens = [AccessToken(user=user,
+                              application_id=applications[user.pk],
+                              token=generate_token(),
+                              expires=expires)
+                  for user in users]
+        AccessToken.objects.bulk_create(tokens)
+        for user, token in zip(users, tokens):
+            self.remember(user, token.token)
+        return tokens
+
+    def bearer(self, user):
+        """
+        The Authorization header of a user, minting a token when it has none
+        """
+        token = getattr(user, 'cached_access_token', None)
+        if token is None:
+            access_token = user.accesstoken_set.first()
+            if access_token is None:
+                access_token = self.mint([user])[0]
+            token = access_token.token
+            self.remember(user, token)
+        return 'Bearer ' + token
+
+
+token_pool = TokenPool()
+
+
 def get_package_version(package):
     """
     Return the version number of a Python package as a list of integers
@@ -200,20 +350,21 @@ class UserOAuthFactory(factory.DjangoModelFactory):
         user = super(UserOAuthFactory, cls)._create(model_class, *args, **kwargs)
         # Force save for post_save signal to create auth client
         user.save()
-        oauth_toolkit_version = get_package_version(oauth2_provider)
-        # If we're using version 0.8.0 or higher
-        if oauth_toolkit_version[0] >= 0 and oauth_toolkit_version[1] >= 8:
-            application = user.oauth2_provider_application.first()
-        else:
-            application = user.application_set.first()
-
-        AccessToken.objects.create(user=user,
-                                   application=application,
-                                   token='token{}'.format(user.id),
-                                   expires=now() + datetime.timedelta(days=1)
-                                   )
+        token_pool.mint([user])
         return user
 
+    @classmethod
+    def create_bulk(cls, size, **kwargs):
+        """
+        Create `size` users, each with an Application and an AccessToken,
+        in a few INSERTs. post_save is not sent, so the Applications are
+        created here instead of by the project's signal handlers.
+        """
+        users = bulk_create_users(cls.build_batch(size, **kwargs))
+        token_pool.create_applications(users)
+        token_pool.mint(users)
+        return users
+
 
 # 模拟user 适用basic / session
 
@@ -228,16 +379,27 @@ class UserBasicFactory(factory.DjangoModelFactory):
 
     @classmethod
     def _create(cls, model_class, *args, **kwargs):
+        raw_password = kwargs.get('password')
+        # Databases下密码加密保存, the hash is computed once per distinct password
+        # and written by the single INSERT, post_save still fires on create
+        kwargs['password'] = cached_make_password(raw_password)
         user = super(UserBasicFactory, cls)._create(model_class, *args, **kwargs)
-        raw_password = user.password
-        # Databases下密码加密保存
-        user.set_password(user.password)
-        # Force save for post_save signal to create auth client
-        user.save()
         # 缓存user的raw_password，用于测试
         user.cached_raw_password = raw_password
         return user
 
+    @classmethod
+    def create_bulk(cls, size, **kwargs):
+        """
+        Create `size` users with `bulk_create`, hashing each distinct
+        password once. post_save is not sent for these users.
+        """
+        users = cls.build_batch(size, **kwargs)
+        for user in users:
+            user.cached_raw_password = user.password
+            user.password = cached_make_password(user.password)
+        return bulk_create_users(users)
+
 
 # 模拟admin
 class AdminFactory(UserBasicFactory):
@@ -1,5 +1,11 @@
 from __future__ import unicode_literals
 
+from django.conf import settings
 from django.db import models
 
 # Create your models here.
+
+
+class Photo(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    image = models.FileField(upload_to='photos', blank=True)
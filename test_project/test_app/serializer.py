@@ -7,4 +7,16 @@ User = get_user_model()
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
-        fields = ('username', 'email')
\ No newline at end of file
+        fields = ('username', 'email')
+
+
+class UserListSerializer(serializers.ModelSerializer):
+    # Counted per user on purpose, the demo of N+1 query detection relies on it
+    group_count = serializers.SerializerMethodField()
+
+    class Meta:
+        model = User
+        fields = ('username', 'email', 'group_count')
+
+    def get_group_count(self, obj):
+        return obj.groups.count()
@@ -1,19 +1,56 @@
 # coding=utf-8
+import io
+import os
+import copy
+import json
+import pickle
+import shutil
+import pstats
+import tempfile
+import unittest
+from functools import partial
 from django.test import TestCase
 
 # Create your tests here.
+from django.conf import settings
+from django.db import connection
+from django.test.utils import override_settings, CaptureQueriesContext
+from django.utils.six import StringIO
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import get_hasher
+from django.contrib.auth.signals import user_logged_in
 from django.core.urlresolvers import reverse
+from django.http import StreamingHttpResponse
+from rest_apitest import backends
 from rest_apitest.main import SchemaTestCase
-from rest_apitest.util import UserBasicFactory
+from rest_apitest.live import SchemaLoadTest, LoadRequest
+from oauth2_provider.models import AccessToken
+from rest_apitest.util import UserBasicFactory, AdminFactory, UserOAuthFactory, basic_auth_str
+from rest_apitest.schema import registry, validate_data, compile_objects, SchemaError
+from rest_apitest.benchmarks import BENCHMARK_OBJECTS, TYPE_CHECK_BUDGET, benchmark_rows, type_check_overhead
+from rest_apitest.perf import measure
+from rest_apitest.stream import iter_events, build, validate_stream
+from rest_apitest import bench
+from rest_apitest.bench import Baseline, run_benchmarks, compare_samples, format_upload_table
+from rest_apitest.runner import SchemaTestRunner
+from rest_apitest.sharding import Timings, lpt_shards, record_test
+from rest_apitest.uploads import LargeFile, files_equal
+from rest_apitest.profiling import (MemoryProbe, MemoryReport, record_memory, endpoint_key, merge_cpu_profiles,
+                                    _cpu_profiles, PhaseReport, PHASES)
+from test_project.test_app.models import Photo
 User = get_user_model()
 
 # session认证情况下
 # 如果需要模拟用户登出，则需要自行添加
-# self.client.logout()
+# self.session_logout()
 
 
 class UserTests(SchemaTestCase):
+    # 在setUpTestData中每个类只创建一次, 各测试共享
+    FIXTURES_FROM_FACTORIES = (
+        ('user', UserBasicFactory),
+    )
+
     def setUp(self):
         # 指定测试采用的认证方式
         # basic_credential   >> basic
@@ -27,8 +64,6 @@ class UserTests(SchemaTestCase):
         # auth_type = session_credential
         # super(UserTests, self).setUp(auth_type=session_credential)
 
-        self.user = UserBasicFactory()
-
     def test_info(self):
         url = reverse('user-info')
         parameters = {}
@@ -37,3 +72,621 @@ class UserTests(SchemaTestCase):
                                         response_object_name)
         self.assertEqual(response.data['username'], self.user.username)
         self.assertEqual(response.data['email'], self.user.email)
+
+    def test_info_budgets(self):
+        url = reverse('user-info')
+        response = self.assertSchemaGet(url, {}, "$infoResponse", self.user,
+                                        max_ms=5000, max_queries=5, max_bytes=1024)
+        self.assertEqual(response.metrics.bytes, len(response.content))
+        with self.assertRaises(self.failureException):
+            self.assertSchemaGet(url, {}, "$infoResponse", self.user, max_queries=0)
+
+
+class BatchUserTests(UserTests):
+    def test_batch(self):
+        other = UserBasicFactory()
+        url = reverse('user-info')
+        cases = [{'method': 'get', 'url': url, 'parameters': {}, 'response_object_name': "$infoResponse",
+                  'user': user} for user in (self.user, other, self.user)]
+        result = self.assertSchemaBatch(cases)
+        self.assertEqual([response.data['username'] for _, _, response, _ in result.entries],
+                         [self.user.username, other.username, self.user.username])
+
+        cases.append({'method': 'get', 'url': url, 'parameters': {}, 'response_object_name': "$infoResponse",
+                      'user': other, 'max_queries': 0})
+        result = self.assertSchemaBatch(cases, fail=False)
+        self.assertEqual([index for index, _, _, _ in result.failures], [3])
+        with self.assertRaises(self.failureException):
+            self.assertSchemaBatch(cases)
+
+
+class MemoryProfiledUserTests(UserTests):
+    PROFILE_MEMORY = True
+
+    def test_memory_report(self):
+        response = self.assertSchemaGet(reverse('user-info'), {}, "$infoResponse", self.user)
+        self.assertIsNotNone(response.memory.peak)
+        self.assertEqual(endpoint_key('get', '/index/', response), 'GET user-info')
+
+        with MemoryProbe() as probe:
+            kept = [MemoryProbe() for _ in range(2000)]
+        if probe.method == 'rss':
+            # RSS only grows by whole pages, the objects are counted
+            counts = dict((site, count) for site, _, count in probe.sites)
+            self.assertGreaterEqual(counts['MemoryProbe objects'], len(kept))
+        else:
+            self.assertGreater(probe.net, 0)
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'memory.json')
+        probe = MemoryProbe()
+        for peak, net, site in ((2048, 0, 'views.py:10'), (4096, 1024, 'views.py:10'), (512, 0, 'views.py:20')):
+            probe.peak, probe.net, probe.sites = peak, net, [(site, peak, 1)]
+            record_memory(path, 'GET user-list' if peak != 512 else 'GET user-info', probe)
+        report = MemoryReport()
+        report.merge_partial(path)
+        rows = report.ranked()
+        self.assertEqual([row['endpoint'] for row in rows], ['GET user-list', 'GET user-info'])
+        self.assertEqual((rows[0]['max_peak_bytes'], rows[0]['mean_net_bytes']), (4096, 512))
+        self.assertEqual(rows[0]['top_sites'], [{'site': 'views.py:10', 'bytes': 6144, 'count': 2}])
+
+
+class CPUProfiledUserTests(UserTests):
+    PROFILE_CPU = True
+
+    def test_cpu_profiles(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(API_PROFILE_DIR=directory):
+            first = self.assertSchemaGet(reverse('user-info'), {}, "$infoResponse", self.user)
+            calls = first.cpu_profile.stats.total_calls
+            response = self.assertSchemaGet(reverse('user-info'), {}, "$infoResponse", self.user)
+        self.assertIn('index', [function for _, _, function in response.cpu_profile.stats.stats])
+        self.assertEqual(first.cpu_profile.stats.total_calls, calls)
+
+        summary = merge_cpu_profiles(directory)
+        self.assertTrue(summary.startswith('GET_user-info: '))
+        self.assertEqual(sorted(os.listdir(directory)),
+                         ['GET_user-info.folded', 'GET_user-info.prof', 'summary.txt'])
+        self.assertEqual(pstats.Stats(os.path.join(directory, 'GET_user-info.prof')).total_calls,
+                         _cpu_profiles['GET user-info'][0].total_calls)
+
+
+class PhaseProfiledUserTests(UserTests):
+    PROFILE_PHASES = True
+
+    def test_phases_per_auth_type(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'phases.json')
+        url = reverse('user-info')
+        with override_settings(API_PHASE_REPORT=path):
+            for auth_type in ('basic_credential', 'session_credential'):
+                self.auth_type = auth_type
+                self.add_credentials = getattr(self, auth_type)
+                response = self.assertSchemaGet(url, {}, "$infoResponse", self.user)
+        self.assertEqual(sorted(response.phases), sorted(PHASES))
+        self.assertGreater(response.phases['authentication'], 0)
+        self.assertGreater(response.phases['serialization'], 0)
+        self.assertGreater(response.phases['rendering'], 0)
+
+        report = PhaseReport()
+        report.merge_partial(path)
+        self.assertEqual(sorted(report.auth_types), ['basic_credential', 'session_credential'])
+        self.assertEqual(report.endpoints['GET user-info']['requests'], 2)
+        self.assertIn('session_credential', report.format())
+
+
+class CachedAuthUserTests(UserTests):
+    CACHE_AUTHENTICATION = True
+
+    def test_password_verified_once(self):
+        url = reverse('user-info')
+        self.assertSchemaGet(url, {}, "$infoResponse", self.user)
+        self.assertIn((self.user.username, self.user.cached_raw_password, self.user.password), backends._verified)
+        # self.user is shared by the class, change a copy
+        user = User.objects.get(pk=self.user.pk)
+        user.set_password('otherpassword1')
+        user.save()
+        response = self.client.get(url)
+        self.assertHttpNotAllowed(response)
+
+
+class PasswordHasherTests(SchemaTestCase):
+    def test_fast_hasher_per_user_password(self):
+        self.assertEqual(get_hasher().algorithm, 'md5')
+        user, other = UserBasicFactory(), UserBasicFactory()
+        self.assertTrue(user.password.startswith('md5$'))
+        self.client.credentials(HTTP_AUTHORIZATION=basic_auth_str(user.username, other.cached_raw_password))
+        self.assertIn(self.client.get(reverse('user-info')).status_code, (401, 403))
+        self.client.credentials(HTTP_AUTHORIZATION=basic_auth_str(user.username, user.cached_raw_password))
+        self.assertEqual(self.client.get(reverse('user-info')).status_code, 200)
+
+
+class SessionUserTests(SchemaTestCase):
+    def setUp(self):
+        super(SessionUserTests, self).setUp(AUTH_TYPE='session_credential')
+        self.user = UserBasicFactory()
+
+    def test_login_reused(self):
+        logins = []
+        handler = lambda **kwargs: logins.append(kwargs['user'])
+        user_logged_in.connect(handler)
+        try:
+            url = reverse('user-info')
+            self.assertSchemaGet(url, {}, "$infoResponse", self.user)
+            self.assertSchemaGet(url, {}, "$infoResponse", self.user)
+            self.assertEqual(len(logins), 1)
+
+            self.session_logout()
+            self.assertSchemaGet(url, {}, "$infoResponse", self.user)
+            self.assertEqual(len(logins), 2)
+        finally:
+            user_logged_in.disconnect(handler)
+
+
+class SessionFixtureUserTests(SchemaTestCase):
+    FIXTURES_FROM_FACTORIES = (
+        ('user', UserBasicFactory),
+    )
+    LOGIN_FIXTURES = ('user',)
+
+    def setUp(self):
+        super(SessionFixtureUserTests, self).setUp(AUTH_TYPE='session_credential')
+        self.logins = []
+        handler = lambda **kwargs: self.logins.append(kwargs['user'])
+        user_logged_in.connect(handler, weak=False)
+        self.addCleanup(user_logged_in.disconnect, handler)
+
+    def test_info(self):
+        self.assertSchemaGet(reverse('user-info'), {}, "$infoResponse", self.user)
+        # Logged in once for the class in setUpTestData
+        self.assertEqual(self.logins, [])
+
+    def test_info_again(self):
+        self.test_info()
+
+
+class OAuthUserTests(SchemaTestCase):
+    def setUp(self):
+        super(OAuthUserTests, self).setUp(AUTH_TYPE='oauth_credential')
+        self.user = UserOAuthFactory.create_bulk(1)[0]
+
+    def test_info(self):
+        response = self.assertSchemaGet(reverse('user-info'), {}, "$infoResponse", self.user)
+        self.assertEqual(response.data['username'], self.user.username)
+
+
+class OAuthFixtureUserTests(SchemaTestCase):
+    # Shared by both tests, without an Application: each test mints the token it sends
+    FIXTURES_FROM_FACTORIES = (
+        ('user', UserBasicFactory),
+    )
+
+    def setUp(self):
+        super(OAuthFixtureUserTests, self).setUp(AUTH_TYPE='oauth_credential')
+
+    def test_info(self):
+        response = self.assertSchemaGet(reverse('user-info'), {}, "$infoResponse", self.user)
+        self.assertEqual(response.data['username'], self.user.username)
+
+    def test_info_again(self):
+        self.test_info()
+
+
+class UserListLoadTests(SchemaLoadTest):
+    CONCURRENCY = 2
+    DURATION = 0.5
+    VALIDATE_SAMPLE = 1.0
+
+    def setUp(self):
+        super(UserListLoadTests, self).setUp()
+        UserBasicFactory.create_bulk(3)
+
+    def test_user_list_load(self):
+        requests = self.schema_requests()
+        self.assertEqual([request.path for request in requests], ['/users/'])
+        report = self.assertLoad(self.run_load(requests))
+        self.assertGreater(report.requests, 0)
+        self.assertEqual(report.validated, report.requests)
+        self.assertEqual(report.status_codes, {200: report.requests})
+
+    def test_gather_permission_matrix(self):
+        users = UserBasicFactory.create_bulk(2)
+        requests = [LoadRequest('get', '/users/', response_object='$userListResponse',
+                                headers={'Authorization': basic_auth_str(user.username, password)},
+                                unauthorized=password != user.cached_raw_password)
+                    for user in users for password in (user.cached_raw_password, 'wrongpassword')]
+        results = self.assertSchemaGather(requests * 5)
+        self.assertEqual([status for status, _ in results[:4]], [200, 403, 200, 403])
+        with self.assertRaises(self.failureException):
+            self.assertSchemaGather([LoadRequest('get', '/users/', headers=requests[1].headers)])
+
+
+class PhotoUploadTests(SchemaTestCase):
+    def setUp(self):
+        super(PhotoUploadTests, self).setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = UserBasicFactory()
+        self.photo = Photo.objects.create(user=self.user)
+
+    def test_large_upload(self):
+        url = reverse('photo-upload', kwargs={'pk': self.photo.pk})
+        # Bigger than FILE_UPLOAD_MAX_MEMORY_SIZE, so the server spills it to a temporary file
+        image = LargeFile(3 * 1024 * 1024 + 7, name='photo.jpg')
+        self.assertPhotoUpload(url, self.photo, self.user, image)
+        self.assertEqual(Photo.objects.get(pk=self.photo.pk).image.size, image.size)
+
+        # The caller's file object is left open, a path would be opened and closed here
+        upload = io.BytesIO(b'photo bytes')
+        upload.name = 'photo.jpg'
+        self.assertPhotoUpload(url, self.photo, self.user, upload)
+        self.assertFalse(upload.closed)
+
+        self.assertFalse(files_equal(LargeFile(image.size, seed=1), image))
+        self.assertPhotoUpload(url, self.photo, None, image, unauthorized=True)
+
+    def test_benchmark_upload(self):
+        url = reverse('photo-upload', kwargs={'pk': self.photo.pk})
+        rows = self.benchmark_upload(url, self.user, 'image', sizes=(1024, 3 * 1024 * 1024))
+        self.assertEqual([row['spilled_to_disk'] for row in rows], [False, True])
+        self.assertEqual([row['status_codes'] for row in rows], [[201], [201]])
+        self.assertEqual(len(format_upload_table(rows).splitlines()), 3)
+
+
+class SchemaRegistryTests(TestCase):
+    def test_schema_loaded_once(self):
+        schema = registry.get(settings.API_SCHEMA)
+        self.assertIs(schema, registry.get(settings.API_SCHEMA))
+        self.assertIn('$infoResponse', schema.objects)
+        with self.assertRaises(TypeError):
+            schema.objects['$infoResponse']['username'] = 'int'
+
+    def test_schema_objects_copy_and_pickle(self):
+        objects = registry.get(settings.API_SCHEMA).objects
+        shallow = copy.copy(objects['$infoResponse'])
+        shallow['username'] = 'int'
+        deep = copy.deepcopy(objects)
+        deep['$infoResponse']['username'] = 'int'
+        self.assertEqual(objects['$infoResponse']['username'], 'string')
+
+        unpickled = pickle.loads(pickle.dumps(objects, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(unpickled, objects)
+        with self.assertRaises(TypeError):
+            unpickled['$infoResponse']['username'] = 'int'
+
+    def test_compiled_validator(self):
+        validator = registry.get(settings.API_SCHEMA).validators['$infoResponse']
+        self.assertEqual(validator.required, frozenset(['username', 'email']))
+        validator.check({'username': 'person', 'email': 'person@example.com'})
+        with self.assertRaises(SchemaError):
+            validator.check({'username': 'person'})
+        with self.assertRaises(SchemaError):
+            validator.check({'username': 'person', 'email': 'person@example.com', 'id': 1})
+
+    def test_validate_all_reports_bad_element(self):
+        validator = registry.get(settings.API_SCHEMA).validators['$infoResponse']
+        rows = [{'username': 'person{0}'.format(i), 'email': 'person{0}@example.com'.format(i)} for i in range(50)]
+        self.assertEqual(validate_data(validator, rows, 'first', many=True).checked, 1)
+        self.assertEqual(validate_data(validator, rows, 'sample:5', many=True).checked, 5)
+        self.assertEqual(validate_data(validator, rows, 'all', many=True).checked, 50)
+
+        rows[37] = {'username': 'person37'}
+        validate_data(validator, rows, 'first', many=True)
+        with self.assertRaises(SchemaError) as context:
+            validate_data(validator, rows, 'all', many=True)
+        self.assertEqual(context.exception.report.failed_index, 37)
+
+    def test_list_field_holding_something_else(self):
+        validators = compile_objects({'$post': {'id': 'int', 'tags': 'array,int', 'users': 'array,$user'},
+                                      '$user': {'name': 'string'}})
+        post = {'id': 1, 'tags': [1], 'users': [{'name': 'person'}]}
+        # Lists of scalars are only looked into with check_types
+        cases = [('users', {'name': 'person'}, False), ('users', 3, False), ('users', 3, True),
+                 ('tags', {'0': 1}, True), ('tags', 3, True)]
+        for field, value, check_types in cases:
+            with self.assertRaises(SchemaError) as context:
+                validate_data(validators['$post'], dict(post, **{field: value}), 'all', check_types=check_types)
+            self.assertIn('Field {0} is not a list'.format(field), str(context.exception))
+
+    def test_bad_validate_mode(self):
+        for mode in ('sample:x', 'sample:', 'every'):
+            with self.assertRaises(ValueError) as context:
+                validate_data(registry.get(settings.API_SCHEMA).validators['$infoResponse'], {}, mode)
+            self.assertIn("'sample:N'", str(context.exception))
+
+    def test_check_types(self):
+        validator = registry.get(settings.API_SCHEMA).validators['$infoResponse']
+        rows = [{'username': 'person{0}'.format(i), 'email': 'person{0}@example.com'.format(i)} for i in range(10)]
+        validate_data(validator, rows, 'all', many=True, check_types=True)
+
+        rows[4]['email'] = 4
+        validate_data(validator, rows, 'all', many=True)
+        with self.assertRaises(SchemaError) as context:
+            validate_data(validator, rows, 'all', many=True, check_types=True)
+        self.assertEqual(context.exception.report.failed_index, 4)
+        self.assertIn('email', str(context.exception))
+
+    def test_check_types_rejects_lookalikes(self):
+        validator = compile_objects(BENCHMARK_OBJECTS)['$userResponse']
+        row = benchmark_rows(1)[0]['user']
+        validate_data(validator, row, check_types=True)
+        for field, value in (('user_following_count', True), ('date_joined', u'2020-01-01T00:00\n2020-01-01T00:00'),
+                             ('date_joined', u'2020-01-01T00:00\n')):
+            with self.assertRaises(SchemaError):
+                validate_data(validator, dict(row, **{field: value}), check_types=True)
+
+    # Wall-clock timing, unreliable next to other processes (e.g. under --parallel)
+    @unittest.skipUnless(os.environ.get('REST_APITEST_BENCHMARKS'), 'set REST_APITEST_BENCHMARKS=1 to run')
+    def test_type_check_overhead(self):
+        keys_only, typed, overhead = type_check_overhead(rows=2000, repeat=7)
+        self.assertLess(overhead, TYPE_CHECK_BUDGET, u"CHECK_TYPES costs {0:.0%} on top of key checks".format(overhead))
+
+
+class RenderedUserTests(UserTests):
+    VALIDATE_RENDERED = True
+    CHECK_TYPES = True
+
+
+class StreamTests(TestCase):
+    validator = compile_objects({'$item': {'name': 'string', 'n': 'int', 'ok': 'boolean',
+                                           'note': 'string,optional'}})['$item']
+
+    def items(self, count=10):
+        return [{'name': u'caf\xe9 "{0}"'.format(i), 'n': -1234 + i, 'ok': i % 2 == 0, 'note': None}
+                for i in range(count)]
+
+    def chunked(self, data, size=1):
+        body = json.dumps(data).encode('utf-8')
+        return [body[start:start + size] for start in range(0, len(body), size)]
+
+    def test_chunk_boundaries(self):
+        data = {'count': 10, 'next': None, 'scores': [1.5e3, 0, True, False], 'results': self.items()}
+        # Every byte its own chunk splits strings, escapes, utf-8 sequences, numbers and literals
+        for size in (1, 2, 3, 7):
+            events = iter_events(self.chunked(data, size))
+            event, value = next(events)
+            self.assertEqual(build(events, event, value), data)
+
+    def test_malformed_json(self):
+        for body in (b'', b'[', b'[{"name": "a",}]', b'[{} {}]', b'[1]', b'{"a": tru}', b'[]]', b'{"a" 1}', b'[1,]',
+                     b'"unterminated', b'{"results": [}'):
+            with self.assertRaises(SchemaError):
+                validate_stream(self.validator, [body], 'all')
+
+    def test_list_and_paginated(self):
+        items = self.items()
+        for data in (items, {'count': 10, 'next': None, 'results': items}):
+            report = validate_stream(self.validator, self.chunked(data, 5), 'all', check_types=True)
+            self.assertEqual((report.many, report.total, report.checked), (True, 10, 10))
+        report = validate_stream(self.validator, self.chunked(items[0], 5), 'all')
+        self.assertEqual((report.many, report.checked), (False, 1))
+
+    def test_failing_index(self):
+        for bad in ({'name': u'x', 'n': u'7', 'ok': True}, {'name': u'x', 'ok': True}):
+            items = self.items()
+            items[7] = bad
+            with self.assertRaises(SchemaError) as context:
+                validate_stream(self.validator, self.chunked({'results': items}, 16), 'all', check_types=True)
+            self.assertEqual(context.exception.report.failed_index, 7)
+            self.assertIn('(at [7])', str(context.exception))
+
+    def test_sample_matches_validate_data(self):
+        # sample:4 of 10 elements checks 0, 3, 6 and 9 in both paths
+        for bad_index, fails in ((3, True), (4, False), (9, True)):
+            items = self.items()
+            items[bad_index] = {'name': u'x'}
+            for validate in (lambda: validate_data(self.validator, items, 'sample:4', many=True),
+                             lambda: validate_stream(self.validator, self.chunked(items, 64), 'sample:4')):
+                if fails:
+                    with self.assertRaises(SchemaError) as context:
+                        validate()
+                    self.assertEqual(context.exception.report.failed_index, bad_index)
+                else:
+                    self.assertEqual(validate().checked, 4)
+
+    def test_streaming_size_counted_as_read(self):
+        chunks = [b'[', b'{"username": "a"}', b']']
+        read = []
+
+        def body():
+            for chunk in chunks:
+                read.append(chunk)
+                yield chunk
+        response, metrics = measure('get', '/stream/', lambda: StreamingHttpResponse(body()))
+        self.assertEqual((read, metrics.bytes, metrics.pending), ([], 0, True))
+        self.assertEqual(b''.join(response.streaming_content), b''.join(chunks))
+        self.assertEqual((metrics.bytes, metrics.pending), (19, False))
+
+
+class UserListTests(SchemaTestCase):
+    N_PLUS_ONE = 'fail'
+
+    def setUp(self):
+        super(UserListTests, self).setUp()
+        self.user = UserBasicFactory()
+
+    def test_list_n_plus_one(self):
+        UserBasicFactory.create_batch(4)
+        with self.assertRaises(self.failureException) as context:
+            self.assertSchemaGet(reverse('user-list'), {}, "$userListResponse", self.user, validate='all')
+        self.assertIn('auth_group', str(context.exception))
+
+    def test_queries_scale_with_rows(self):
+        with self.assertRaises(self.failureException):
+            self.assertQueriesDoNotScale(reverse('user-list'), UserBasicFactory.create_batch, self.user)
+
+
+class BenchmarkTests(TestCase):
+    def test_run_benchmarks(self):
+        UserBasicFactory.create_batch(3)
+        results = run_benchmarks(self.client, registry.get(settings.API_SCHEMA), warmup=1, iterations=3)
+        endpoint, = results['endpoints']
+        self.assertEqual(endpoint['path'], '/users/')
+        self.assertEqual(endpoint['status_codes'], [200])
+        self.assertEqual(endpoint['iterations'], 3)
+        self.assertLessEqual(endpoint['p50_ms'], endpoint['p99_ms'])
+        # tracemalloc, or the process' RSS and gc objects on Python 2
+        self.assertIn(endpoint['alloc_method'], ('tracemalloc', 'rss'))
+        self.assertIsNotNone(endpoint['net_alloc_bytes'])
+
+        results = run_benchmarks(self.client, registry.get(settings.API_SCHEMA), warmup=0, iterations=1,
+                                 allocations=False)
+        self.assertNotIn('alloc_method', results['endpoints'][0])
+
+
+class BaselineTests(SchemaTestCase):
+    def setUp(self):
+        super(BaselineTests, self).setUp()
+        self.user = UserBasicFactory()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_record_then_compare(self):
+        path = os.path.join(self.directory, 'baseline.json')
+        with self.settings(API_BENCHMARK_BASELINE=path):
+            self.assertNoRegression(reverse('user-info'), self.user, samples=5)
+            self.assertNoRegression(reverse('user-info'), self.user, samples=5)
+            self.assertFalse(os.path.exists(path))
+            SchemaTestRunner().write_baseline()
+        self.assertEqual(len(Baseline(path).get('get', reverse('user-info'))['timings_ms']), 5)
+        self.assertFalse(os.path.exists(path + '.partial'))
+
+    def test_parallel_workers_record(self):
+        path = os.path.join(self.directory, 'baseline.json')
+        # Two workers that loaded the baseline file before either recorded anything
+        workers = [bench.Baseline(path), bench.Baseline(path)]
+        self.addCleanup(bench._baselines.clear)
+        with self.settings(API_BENCHMARK_BASELINE=path):
+            for worker, url in zip(workers, [reverse('user-info'), reverse('user-list')]):
+                bench._baselines[os.path.abspath(path)] = worker
+                self.assertNoRegression(url, self.user, samples=5)
+            SchemaTestRunner().write_baseline()
+        self.assertEqual(sorted(Baseline(path).endpoints),
+                         sorted([u'GET ' + reverse('user-info'), u'GET ' + reverse('user-list')]))
+
+    def test_mode_from_environment(self):
+        path = os.path.join(self.directory, 'baseline.json')
+        os.environ['REST_APITEST_BASELINE_MODE'] = 'record'
+        self.addCleanup(os.environ.pop, 'REST_APITEST_BASELINE_MODE')
+        with self.settings(API_BENCHMARK_BASELINE=path):
+            self.assertSchemaGet(reverse('user-info'), {}, "$infoResponse", self.user)
+        self.assertTrue(os.path.exists(path + '.partial'))
+
+    def test_compare_samples(self):
+        entry = {'timings_ms': [10.0, 10.5, 9.8, 10.2, 10.1, 9.9, 10.3, 10.0], 'queries': [2] * 8}
+        self.assertEqual(compare_samples(entry, [10.1, 9.9, 10.4, 10.0, 10.2, 9.8, 10.0, 10.3], [2] * 8), [])
+        regressions = compare_samples(entry, [20.1, 19.9, 20.4, 20.0, 20.2, 19.8, 20.0, 20.3], [3] * 8)
+        self.assertEqual(len(regressions), 2)
+
+
+class ShardingTests(TestCase):
+    def test_lpt_shards(self):
+        shards = lpt_shards({'a': 7, 'b': 5, 'c': 4, 'd': 3, 'e': 1}, 2)
+        self.assertEqual(shards, [['a', 'd'], ['b', 'c', 'e']])
+
+    def test_record_and_estimate(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'timings.json')
+        record_test(path, 'app.Tests.test_a', 2.0, [('get', '/info/', 0.5), ('get', '/users/', 1.5)])
+        timings = Timings(path)
+        timings.merge_partial(registry.get(settings.API_SCHEMA))
+        timings.save()
+
+        timings = Timings(path)
+        self.assertEqual(timings.tests, {'app.Tests.test_a': 2.0})
+        self.assertEqual(timings.endpoints, {'GET info/': [0.5, 1], 'GET users/': [1.5, 1]})
+        # two requests per test, the schema only declares GET users/ (1.5s)
+        default = timings.default_estimate(registry.get(settings.API_SCHEMA))
+        self.assertEqual(default, 3.0)
+        self.assertEqual(timings.estimate(['app.Tests.test_a', 'app.Tests.test_b'], default), 4.0)
+        self.assertEqual(timings.estimate(['app.Other.test_c'], default), 3.0)
+
+    def test_shard_lowers_processes(self):
+        labels = ['test_project.test_app.tests.' + name for name in
+                  ('ShardingTests', 'FactoryTests', 'StreamTests', 'BenchmarkTests')]
+        runner = SchemaTestRunner(parallel=3, shard='1/2')
+        suite = runner.build_suite(labels)
+        self.assertEqual((runner.parallel, suite.processes, len(suite.subsuites)), (2, 2, 2))
+
+        runner = SchemaTestRunner(parallel=3, shard='1/2')
+        suite = runner.build_suite(labels[:2])
+        self.assertEqual(runner.parallel, 1)
+        self.assertFalse(isinstance(suite, runner.parallel_test_suite))
+
+
+    def test_shards_split_from_the_same_timings(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'timings.json')
+        labels = ['test_project.test_app.tests.' + name for name in
+                  ('ShardingTests', 'FactoryTests', 'StreamTests', 'BenchmarkTests', 'SchemaRegistryTests')]
+        all_ids = set(test.id() for test in SchemaTestRunner(parallel=1).build_suite(labels))
+        with open(path, 'w') as file:
+            json.dump({'tests': dict((test_id, 1.0) for test_id in all_ids)}, file)
+
+        shards = []
+        with self.settings(API_TEST_TIMINGS=path):
+            for shard in ('1/2', '2/2'):
+                runner = SchemaTestRunner(parallel=1, shard=shard, verbosity=0)
+                runner.test_runner = partial(unittest.TextTestRunner, stream=StringIO())
+                test_ids = [test.id() for test in runner.build_suite(labels)]
+                shards.append(test_ids)
+                # As if the shard's tests had taken much longer than recorded
+                for test_id in test_ids:
+                    record_test(path, test_id, 50.0, [])
+                runner.run_suite(runner.test_suite())
+            self.assertEqual(sorted(shards[0] + shards[1]), sorted(all_ids))
+            self.assertEqual(Timings(path).tests, dict((test_id, 1.0) for test_id in all_ids))
+
+            SchemaTestRunner(merge_timings=True).run_tests(labels)
+        self.assertEqual(Timings(path).tests, dict((test_id, 50.0) for test_id in all_ids))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class FactoryTests(TestCase):
+    def setUp(self):
+        # The factory reads the largest id on its first use, keep it out of the counted queries
+        UserBasicFactory.build()
+
+    def test_password_hashed_once(self):
+        with self.assertNumQueries(1):
+            user = UserBasicFactory(password='samepassword1')
+        admin = AdminFactory(password='samepassword1')
+        self.assertEqual(user.password, admin.password)
+        self.assertEqual(admin.cached_raw_password, 'samepassword1')
+        self.assertTrue(User.objects.get(pk=admin.pk).check_password('samepassword1'))
+        self.assertTrue(admin.is_superuser)
+
+    def test_password_per_user(self):
+        first, second = UserBasicFactory(), UserBasicFactory()
+        self.assertNotEqual(first.cached_raw_password, second.cached_raw_password)
+        self.assertFalse(second.check_password(first.cached_raw_password))
+
+    def test_create_bulk(self):
+        with self.assertNumQueries(2):
+            users = UserBasicFactory.create_bulk(20)
+        self.assertEqual(len(set(user.pk for user in users)), 20)
+        self.assertTrue(User.objects.get(pk=users[-1].pk).check_password(users[-1].cached_raw_password))
+
+    def test_create_bulk_more_than_a_batch(self):
+        with CaptureQueriesContext(connection) as context:
+            users = UserBasicFactory.create_bulk(600)
+        self.assertEqual(User.objects.filter(pk__in=[user.pk for user in users]).count(), 600)
+        # Each INSERT stays within the backend's limit on query parameters
+        fields = [field for field in User._meta.concrete_fields if not field.primary_key]
+        batch_size = connection.ops.bulk_batch_size(fields, users)
+        inserts = [query for query in context.captured_queries if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), -(-len(users) // batch_size))
+
+    def test_create_bulk_oauth(self):
+        users = UserOAuthFactory.create_bulk(5)
+        tokens = AccessToken.objects.filter(user__in=users)
+        self.assertEqual(sorted(tokens.values_list('token', flat=True)),
+                         sorted(user.cached_access_token for user in users))
@@ -1,7 +1,9 @@
 from django.conf.urls import url
-from views import index
+from views import index, user_list, photo_upload
 
 
 urlpatterns = [
-    url('index/$', index, name='user-info')
+    url('index/$', index, name='user-info'),
+    url('users/$', user_list, name='user-list'),
+    url(r'photos/(?P<pk>\d+)/$', photo_upload, name='photo-upload')
 ]
@@ -1,8 +1,12 @@
 from django.shortcuts import render
 from rest_framework.views import APIView
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, parser_classes, permission_classes
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAuthenticated
+from django.shortcuts import get_object_or_404
+from models import Photo
 from rest_framework.response import Response
-from serializer import UserSerializer
+from serializer import UserSerializer, UserListSerializer
 from rest_framework import status
 # Create your views here.
 from django.contrib.auth import get_user_model
@@ -14,3 +18,19 @@ User = get_user_model()
 def index(request):
     serializer = UserSerializer(request.user)
     return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def user_list(request):
+    serializer = UserListSerializer(User.objects.order_by('pk'), many=True)
+    return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@parser_classes((MultiPartParser,))
+@permission_classes((IsAuthenticated,))
+def photo_upload(request, pk):
+    photo = get_object_or_404(Photo, pk=pk, user=request.user)
+    photo.image = request.data['image']
+    photo.save()
+    return Response({'id': photo.pk}, status=status.HTTP_201_CREATED)